@@ -0,0 +1,133 @@
+import os
+import time
+import sqlite3
+import hashlib
+import threading
+from collections import OrderedDict
+from typing import Dict, Hashable, List
+import numpy as np
+
+class LRUCache:
+    """Small in-memory least-recently-used cache. Entries older than ttl seconds (if given) count as misses."""
+
+    def __init__(self, max_size: int, ttl: float = None) -> None:
+        self.max_size = max_size
+        self.ttl = ttl
+        self.items = OrderedDict() # key -> (value, insertion time)
+        self.lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, key: Hashable):
+        with self.lock:
+            if key in self.items and self.ttl is not None and time.monotonic() - self.items[key][1] > self.ttl:
+                del self.items[key]
+            if key not in self.items:
+                self.misses += 1
+                return None
+            self.hits += 1
+            self.items.move_to_end(key)
+            return self.items[key][0]
+
+    def put(self, key: Hashable, value) -> None:
+        with self.lock:
+            self.items[key] = (value, time.monotonic())
+            self.items.move_to_end(key)
+            while len(self.items) > self.max_size:
+                self.items.popitem(last=False)
+
+    def stats(self) -> Dict[str, float]:
+        lookups = self.hits + self.misses
+        return {'size': len(self.items), 'hits': self.hits, 'misses': self.misses, 'hit_rate': self.hits / lookups if lookups else 0}
+
+    def __len__(self) -> int:
+        return len(self.items)
+
+
+class EmbeddingCache:
+    """Content-addressed embedding cache: an in-memory LRU in front of an on-disk SQLite store.
+    Entries are keyed by (model, dimensions, normalized text); the disk store is bounded by max_disk_entries,
+    evicting the least recently used entries first."""
+
+    def __init__(self, path: str = 'cache/embeddings.sqlite', max_memory_entries: int = 10000, max_disk_entries: int = 1000000) -> None:
+        self.path = path
+        self.max_disk_entries = max_disk_entries
+        self.memory = LRUCache(max_memory_entries)
+        self.lock = threading.Lock()
+        if os.path.dirname(path): os.makedirs(os.path.dirname(path), exist_ok=True)
+        self.db = sqlite3.connect(path, check_same_thread=False)
+        self.db.execute('CREATE TABLE IF NOT EXISTS embeddings (key TEXT PRIMARY KEY, vector BLOB, last_access REAL)')
+        self.db.execute('CREATE INDEX IF NOT EXISTS embeddings_last_access ON embeddings (last_access)')
+        self.db.commit()
+        self.disk_entries = self.db.execute('SELECT COUNT(*) FROM embeddings').fetchone()[0] # kept up to date by put_many / evict
+
+        # stats
+        self.memory_hits = 0
+        self.disk_hits = 0
+        self.misses = 0
+
+    @staticmethod
+    def normalize_text(text: str) -> str:
+        return ' '.join(text.split())
+
+    @staticmethod
+    def key(model: str, dimensions: int, text: str) -> str:
+        return hashlib.sha256(f'{model}\x00{dimensions}\x00{EmbeddingCache.normalize_text(text)}'.encode()).hexdigest()
+
+    def get_many(self, model: str, dimensions: int, texts: List[str]) -> Dict[str, np.ndarray]:
+        """Return {text: embedding} for every given text present in the cache."""
+        found, disk_keys = {}, {}
+        for text in texts:
+            key = self.key(model, dimensions, text)
+            vector = self.memory.get(key)
+            if vector is not None:
+                found[text] = vector
+                self.memory_hits += 1
+            else:
+                disk_keys[key] = text
+        if disk_keys:
+            with self.lock:
+                keys = list(disk_keys)
+                rows = []
+                for i in range(0, len(keys), 500): # stay under SQLite's host parameter limit
+                    chunk = keys[i:i + 500]
+                    rows.extend(self.db.execute(f'SELECT key, vector FROM embeddings WHERE key IN ({",".join("?" * len(chunk))})', chunk).fetchall())
+                self.db.executemany('UPDATE embeddings SET last_access = ? WHERE key = ?', [(time.time(), key) for key, _ in rows])
+                self.db.commit()
+            for key, blob in rows:
+                vector = np.frombuffer(blob, dtype=np.float32)
+                self.memory.put(key, vector)
+                found[disk_keys[key]] = vector
+            self.disk_hits += len(rows)
+            self.misses += len(disk_keys) - len(rows)
+        return found
+
+    def put_many(self, model: str, dimensions: int, texts: List[str], embeddings: np.ndarray) -> None:
+        rows = []
+        for text, embedding in zip(texts, embeddings):
+            key = self.key(model, dimensions, text)
+            vector = np.asarray(embedding, dtype=np.float32)
+            self.memory.put(key, vector)
+            rows.append((key, vector.tobytes(), time.time()))
+        with self.lock:
+            inserted = self.db.executemany('INSERT OR IGNORE INTO embeddings (key, vector, last_access) VALUES (?, ?, ?)', rows).rowcount
+            if inserted < len(rows): # some keys were already stored: refresh them instead
+                self.db.executemany('UPDATE embeddings SET vector = ?, last_access = ? WHERE key = ?', [(vector, access, key) for key, vector, access in rows])
+            self.disk_entries += inserted
+            self.evict()
+            self.db.commit()
+
+    def evict(self) -> None:
+        """Drop the least recently used disk entries beyond max_disk_entries."""
+        excess = self.disk_entries - self.max_disk_entries
+        if excess > 0:
+            self.db.execute('DELETE FROM embeddings WHERE key IN (SELECT key FROM embeddings ORDER BY last_access LIMIT ?)', (excess,))
+            self.disk_entries -= excess
+
+    def stats(self) -> Dict[str, float]:
+        lookups = self.memory_hits + self.disk_hits + self.misses
+        return {'memory_hits': self.memory_hits, 'disk_hits': self.disk_hits, 'misses': self.misses,
+                'hit_rate': (self.memory_hits + self.disk_hits) / lookups if lookups else 0}
+
+    def close(self) -> None:
+        self.db.close()
@@ -1,34 +1,212 @@
 import openai
 import time
-from typing import List, Dict
+import asyncio
+import threading
+import weakref
+from typing import List, Dict, Iterator, Tuple
 import numpy as np
+from RateLimiter import RateLimiter
+from EmbeddingCache import EmbeddingCache
+from ReplayStore import ReplayStore
+from Tokens import count_tokens, count_message_tokens
+from UsageTracker import UsageTracker
+
+class OpenAIBackend:
+    """Sends requests to the OpenAI API. Any object with the same methods can be used as a GPTEndpoint backend."""
+
+    def __init__(self, API_KEY: str) -> None:
+        self.API_KEY = API_KEY
+        openai.api_key = API_KEY
+        self.async_client = None
+
+    def complete(self, model: str, message_stream: List[Dict]) -> str:
+        return openai.chat.completions.create(model=model, messages=message_stream).choices[0].message.content
+
+    def complete_stream(self, model: str, message_stream: List[Dict]) -> Iterator[str]:
+        for chunk in openai.chat.completions.create(model=model, messages=message_stream, stream=True):
+            if chunk.choices and chunk.choices[0].delta.content:
+                yield chunk.choices[0].delta.content
+
+    def embedding(self, model: str, texts: List[str], dimensions: int) -> np.ndarray:
+        response = openai.embeddings.create(input=texts, model=model, dimensions=dimensions)
+        return np.array([np.array(item.embedding) for item in response.data])
+
+    async def acomplete(self, model: str, message_stream: List[Dict]) -> str:
+        response = await self.get_async_client().chat.completions.create(model=model, messages=message_stream)
+        return response.choices[0].message.content
+
+    async def aembedding(self, model: str, texts: List[str], dimensions: int) -> np.ndarray:
+        response = await self.get_async_client().embeddings.create(input=texts, model=model, dimensions=dimensions)
+        return np.array([np.array(item.embedding) for item in response.data])
+
+    def get_async_client(self) -> openai.AsyncOpenAI:
+        if self.async_client is None:
+            self.async_client = openai.AsyncOpenAI(api_key=self.API_KEY)
+        return self.async_client
+
 
 class GPTEndpoint:
 
-    #TODO: track tokens / cost
-    
-    def __init__(self, API_KEY: str, chat_model: str = 'gpt-3.5-turbo-0125', embedding_model: str = "text-embedding-3-small", limit_call_frequency: bool = False, call_cooldown: float = 10) -> None:
+    def __init__(self, API_KEY: str, chat_model: str = 'gpt-3.5-turbo-0125', embedding_model: str = "text-embedding-3-small",
+                 limit_call_frequency: bool = False, call_cooldown: float = 10,
+                 requests_per_minute: float = None, tokens_per_minute: float = None, max_concurrent_requests: int = 8,
+                 embedding_cache: EmbeddingCache = None, replay_store: ReplayStore = None, backend = None) -> None:
+        """
+            limit_call_frequency: space calls at least call_cooldown seconds apart (calls wait instead of failing).
+            requests_per_minute / tokens_per_minute: token-bucket limits; calls over the limit are queued.
+            max_concurrent_requests: maximum number of requests in flight at once (sync callers and each event loop).
+            embedding_cache: if given, embeddings are looked up there first and only misses are sent to the API.
+            replay_store: record every live call to the store, or (in replay mode) answer every call from it with no network.
+            backend: where requests are sent (defaults to OpenAIBackend; see MockBackend for load testing).
+
+            Every call takes a phase (importance, summary, reflect, dialogue, context, emotion; embedding calls default to
+            'embedding') and a caller (the NPC making it); tokens (counted locally), cost and latency are recorded in self.usage.
+        """
         self.call_cooldown = call_cooldown # seconds
         self.last_call_timestamp = -self.call_cooldown
         self.limit_call_frequency = limit_call_frequency
         self.chat_model = chat_model
         self.embedding_model = embedding_model
-        openai.api_key = API_KEY
+        self.backend = backend if backend is not None else OpenAIBackend(API_KEY)
+
+        # rate limiting
+        request_burst = None
+        if limit_call_frequency and requests_per_minute is None: requests_per_minute, request_burst = 60 / call_cooldown, 1 # no bursts
+        self.rate_limiter = RateLimiter(requests_per_minute, tokens_per_minute, request_burst)
+        self.max_concurrent_requests = max_concurrent_requests
+        self.semaphore = threading.BoundedSemaphore(max_concurrent_requests)
+        self.async_semaphores = weakref.WeakKeyDictionary() # event loop -> asyncio.Semaphore
+
+        self.embedding_cache = embedding_cache
+        self.replay_store = replay_store
+        self.usage = UsageTracker()
+
+    def complete(self, message_stream: List[Dict], phase: str = 'other', caller: str = None) -> str:
+        start = time.perf_counter()
+        if self.replaying:
+            return self.replay_completion(message_stream, phase, caller, start)
+        self.rate_limiter.acquire(self.estimate_tokens(message_stream))
+        with self.semaphore:
+            sent = time.perf_counter()
+            output = self.backend.complete(self.chat_model, message_stream)
+        return self.finish_completion(message_stream, output, phase, caller, start, sent)
 
-    def complete(self, message_stream: List[Dict]) -> str:
-        if self.limit_call_frequency and time.time() - self.last_call_timestamp < self.call_cooldown:
-            return "Too many calls too fast."
-        output = openai.chat.completions.create(
-            model=self.chat_model,
-            messages=message_stream
-        ).choices[0].message.content
+    def complete_stream(self, message_stream: List[Dict], phase: str = 'other', caller: str = None) -> Iterator[str]:
+        """Like complete, but yield the text deltas as they arrive. The generator returns the assembled text (recorded as usual)."""
+        start = time.perf_counter()
+        if self.replaying:
+            output = self.replay_completion(message_stream, phase, caller, start)
+            yield output
+            return output
+        self.rate_limiter.acquire(self.estimate_tokens(message_stream))
+        deltas = []
+        with self.semaphore:
+            sent = time.perf_counter()
+            for delta in self.backend.complete_stream(self.chat_model, message_stream):
+                deltas.append(delta)
+                yield delta
+        return self.finish_completion(message_stream, ''.join(deltas), phase, caller, start, sent)
+
+    def embedding(self, texts:List[str], dimensions: int, phase: str = 'embedding', caller: str = None) -> np.ndarray:
+        start = time.perf_counter()
+        processed_texts = [EmbeddingCache.normalize_text(text) for text in texts]
+        if self.replaying:
+            return self.replay_embeddings(processed_texts, dimensions, phase, caller, start)
+        cached, missing = self.cached_embeddings(processed_texts, dimensions)
+        if missing:
+            self.rate_limiter.acquire(sum(self.estimate_tokens(text) for text in missing))
+            with self.semaphore:
+                sent = time.perf_counter()
+                embeddings = self.backend.embedding(self.embedding_model, missing, dimensions)
+            cached.update(self.finish_embedding(missing, embeddings, dimensions, phase, caller, start, sent))
+        return self.collect_embeddings(processed_texts, cached, dimensions)
+
+    async def acomplete(self, message_stream: List[Dict], phase: str = 'other', caller: str = None) -> str:
+        """Async version of complete."""
+        start = time.perf_counter()
+        if self.replaying:
+            return self.replay_completion(message_stream, phase, caller, start)
+        await self.rate_limiter.aacquire(self.estimate_tokens(message_stream))
+        async with self.get_async_semaphore():
+            sent = time.perf_counter()
+            output = await self.backend.acomplete(self.chat_model, message_stream)
+        return self.finish_completion(message_stream, output, phase, caller, start, sent)
+
+    async def aembedding(self, texts: List[str], dimensions: int, phase: str = 'embedding', caller: str = None) -> np.ndarray:
+        """Async version of embedding."""
+        start = time.perf_counter()
+        processed_texts = [EmbeddingCache.normalize_text(text) for text in texts]
+        if self.replaying:
+            return self.replay_embeddings(processed_texts, dimensions, phase, caller, start)
+        cached, missing = self.cached_embeddings(processed_texts, dimensions)
+        if missing:
+            await self.rate_limiter.aacquire(sum(self.estimate_tokens(text) for text in missing))
+            async with self.get_async_semaphore():
+                sent = time.perf_counter()
+                embeddings = await self.backend.aembedding(self.embedding_model, missing, dimensions)
+            cached.update(self.finish_embedding(missing, embeddings, dimensions, phase, caller, start, sent))
+        return self.collect_embeddings(processed_texts, cached, dimensions)
+
+    # Shared by the sync, streaming and async calls: everything but the rate limiter wait and the request itself.
+
+    @property
+    def replaying(self) -> bool:
+        return self.replay_store is not None and self.replay_store.replaying
+
+    def replay_completion(self, message_stream: List[Dict], phase: str, caller: str, start: float) -> str:
+        output = self.replay_store.replay_completion(self.chat_model, message_stream)
+        self.track_completion(message_stream, output, phase, caller, start, start)
+        return output
+
+    def finish_completion(self, message_stream: List[Dict], output: str, phase: str, caller: str, start: float, sent: float) -> str:
+        """Track a completion answered by the backend and record it to the replay store, if any."""
         self.last_call_timestamp = time.time()
+        self.track_completion(message_stream, output, phase, caller, start, sent)
+        if self.replay_store: self.replay_store.record_completion(self.chat_model, message_stream, output)
         return output
-    
-    def embedding(self, texts:List[str], dimensions: int) -> np.ndarray:
-        if self.limit_call_frequency and time.time() - self.last_call_timestamp < self.call_cooldown:
-            return "Too many calls too fast."
-        processed_texts = [text.replace("\n", " ") for text in texts]
-        response = openai.embeddings.create(input=processed_texts, model=self.embedding_model, dimensions=dimensions)
+
+    def replay_embeddings(self, texts: List[str], dimensions: int, phase: str, caller: str, start: float) -> np.ndarray:
+        self.track_embedding(texts, phase, caller, start, start)
+        return self.replay_store.replay_embeddings(self.embedding_model, dimensions, texts)
+
+    def cached_embeddings(self, texts: List[str], dimensions: int) -> Tuple[Dict[str, np.ndarray], List[str]]:
+        """({text: embedding} found in the embedding cache, the distinct texts that must be sent)."""
+        cached = self.embedding_cache.get_many(self.embedding_model, dimensions, texts) if self.embedding_cache else {}
+        return cached, list(dict.fromkeys(text for text in texts if text not in cached))
+
+    def finish_embedding(self, texts: List[str], embeddings: np.ndarray, dimensions: int, phase: str, caller: str, start: float, sent: float) -> Dict[str, np.ndarray]:
+        """Track embeddings answered by the backend and map each text to its embedding (adding them to the embedding cache, if any)."""
         self.last_call_timestamp = time.time()
-        return np.array([np.array(item.embedding) for item in response.data])
+        self.track_embedding(texts, phase, caller, start, sent)
+        if self.embedding_cache: self.embedding_cache.put_many(self.embedding_model, dimensions, texts, embeddings)
+        return dict(zip(texts, embeddings))
+
+    def collect_embeddings(self, texts: List[str], embeddings: Dict[str, np.ndarray], dimensions: int) -> np.ndarray:
+        """Embeddings of the requested texts in order (recorded to the replay store, if any)."""
+        embeddings = np.array([embeddings[text] for text in texts])
+        if self.replay_store: self.replay_store.record_embeddings(self.embedding_model, dimensions, texts, embeddings)
+        return embeddings
+
+    def track_completion(self, message_stream: List[Dict], output: str, phase: str, caller: str, start: float, sent: float) -> None:
+        """Record a finished completion; start is when the call was made, sent when it got past the rate limiter."""
+        prompt_tokens = self.estimate_tokens(message_stream)
+        self.usage.record(self.chat_model, phase, caller, prompt_tokens, count_tokens(output), time.perf_counter() - start, sent - start)
+        self.usage.record_prompt(phase, caller, '\n'.join(f"{message['role']}: {message['content']}" for message in message_stream), prompt_tokens)
+
+    def track_embedding(self, texts: List[str], phase: str, caller: str, start: float, sent: float) -> None:
+        self.usage.record(self.embedding_model, phase, caller, sum(self.estimate_tokens(text) for text in texts), 0,
+                          time.perf_counter() - start, sent - start)
+
+    def get_async_semaphore(self) -> asyncio.Semaphore:
+        """asyncio semaphores are bound to a single event loop, so keep one per running loop."""
+        loop = asyncio.get_running_loop()
+        if loop not in self.async_semaphores:
+            self.async_semaphores[loop] = asyncio.Semaphore(self.max_concurrent_requests)
+        return self.async_semaphores[loop]
+
+    @staticmethod
+    def estimate_tokens(content) -> int:
+        """Token count of a string or message stream, used for rate limiting."""
+        if isinstance(content, str):
+            return count_tokens(content)
+        return count_message_tokens(content)
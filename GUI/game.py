@@ -1,6 +1,6 @@
 import pygame as pg
 from pygame.surface import Surface
-from typing import Tuple, Dict
+from typing import Callable, Tuple, Dict
 from collections import deque
 from npc import BaseNPC as NPC
 
@@ -280,6 +280,8 @@ class AIVN:
         npc.is_alive = False
         self.animation_queue.add_animation("killflash", -1)
         self.handle_music(sfx_to_play="knife_slash")
+        if self.on_NPC_killed is not None:
+            self.on_NPC_killed(npc.name)
 
     def check_secret_word(self, response: str) -> None:
         # TODO: Implement Cosine Similarity detection. For now we use a simple check
@@ -301,9 +303,10 @@ class AIVN:
 
 
 
-    def __init__(self, area_to_NPC: Dict[str, NPC], secret_word: str) -> None:
+    def __init__(self, area_to_NPC: Dict[str, NPC], secret_word: str, on_NPC_killed: Callable[[str], None] = None) -> None:
         self.cur_game_state = 0 # 0 for Title Screen, 1 for Map View, 2 for NPC View
         self.secret_word = secret_word
+        self.on_NPC_killed = on_NPC_killed # (victim name), e.g. Grapevine.kill to mark the NPC dead and spread the news
         # Set time
         self.cur_time = 0
         self.triggered_lose = False
@@ -8,6 +8,7 @@ from npc import DummyNPC
         a) For the sprite param of NPC, pass in the file path of the desired npc via assets/npcs/*.png
         b) The areas are "castle", "farm", "red_house", "blue_house"
     2) Create an AIVN object and pass in the dictionary and secret phrase into the constructor
+        a) Optionally pass on_NPC_killed (e.g. the kill method of a Grapevine) to spread news of murders
     3) Call the start_game_loop() method of the AIVN object
 
     The goal of the player is to try to get any NPC to reveal the secret phrase (which the player doesn't know)
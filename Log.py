@@ -1,6 +1,7 @@
 import os
 import csv
 import time
+import threading
 
 class Log:
     
@@ -9,6 +10,7 @@ class Log:
         self.foldername = foldername
         self.disabled = disabled
         self.filename = ''
+        self.lock = threading.Lock() # rows may be written from concurrent conversations
         if not disabled:
             self.filename = self.setup_file()
             self.create_csv()
@@ -33,7 +35,7 @@ class Log:
             return
         current_time = time.time() - self.start_time
         game_time = time.strftime("%H:%M:%S", time.gmtime(current_time))
-        with open(self.filename, 'a', newline='') as file:
+        with self.lock, open(self.filename, 'a', newline='') as file:
             writer = csv.writer(file)
             writer.writerow([game_time, text])
     
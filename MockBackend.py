@@ -0,0 +1,120 @@
+import re
+import time
+import random
+import asyncio
+import hashlib
+import threading
+from typing import Dict, Iterator, List
+import numpy as np
+
+class LatencyModel:
+    """Simulated request latency: mean seconds plus jitter drawn from a normal, uniform or lognormal distribution."""
+
+    def __init__(self, mean: float = 0, jitter: float = 0, distribution: str = 'normal') -> None:
+        assert distribution in ('normal', 'uniform', 'lognormal'), f'Unknown latency distribution {distribution}.'
+        self.mean = mean
+        self.jitter = jitter
+        self.distribution = distribution
+
+    def sample(self, rng: random.Random) -> float:
+        if self.distribution == 'uniform':
+            return max(0, rng.uniform(self.mean - self.jitter, self.mean + self.jitter))
+        if self.distribution == 'lognormal':
+            return rng.lognormvariate(np.log(self.mean), self.jitter) if self.mean > 0 else 0
+        return max(0, rng.gauss(self.mean, self.jitter))
+
+
+class MockBackend:
+    """Offline GPTEndpoint backend for load testing. Completions are templated so that callers parse them exactly as they
+    would real responses (importance ratings, newline-separated questions, '<character>: <speech>' lines, emotion levels),
+    and embeddings are unit vectors seeded by a hash of the text. Output depends only on the request, so runs are repeatable.
+    Latency is simulated per call type (see CALL_TYPES); pass e.g. latency={'dialogue': LatencyModel(0.8, 0.2)}."""
+
+    CALL_TYPES = ['importance', 'questions', 'insight', 'dialogue', 'context', 'summary', 'emotion', 'characteristics', 'other', 'embedding']
+
+    # substrings identifying which prompt (NPC.Prompts / Memory) a request came from
+    PROMPT_MARKERS = [
+        ('importance', 'rate the likely poignancy'),
+        ('questions', 'most salient highlevel questions'),
+        ('insight', 'high-level insight'),
+        ('emotion', 'generate a number from -10 to 10'),
+        ('summary', 'Succinctly summarize the conversation'),
+        ('context', 'Briefly summarize the context'),
+        ('characteristics', 'How would you describe'),
+        ('dialogue', 'How would you respond?'),
+    ]
+
+    SUBJECTS = ['the castle Morne', 'the Outskirts', 'the baron of Grimlock', 'the harvest', 'the treasure', 'the town guard', 'the beasts']
+
+    def __init__(self, latency: Dict[str, LatencyModel] = None, seed: int = 0) -> None:
+        self.latency = latency if latency is not None else {}
+        self.seed = seed
+        self.rng = random.Random(seed) # latency jitter only
+        self.lock = threading.Lock()
+
+    def call_type(self, message_stream: List[Dict]) -> str:
+        content = '\n'.join(message['content'] for message in message_stream)
+        for call_type, marker in MockBackend.PROMPT_MARKERS:
+            if marker in content:
+                return call_type
+        return 'other'
+
+    def delay(self, call_type: str) -> float:
+        if call_type not in self.latency:
+            return 0
+        with self.lock:
+            return self.latency[call_type].sample(self.rng)
+
+    def request_rng(self, *parts: str) -> random.Random:
+        digest = hashlib.sha256('\x00'.join((str(self.seed),) + parts).encode()).digest()
+        return random.Random(int.from_bytes(digest[:8], 'little'))
+
+    def respond(self, call_type: str, message_stream: List[Dict]) -> str:
+        content = message_stream[-1]['content']
+        rng = self.request_rng(call_type, content)
+        subject = rng.choice(MockBackend.SUBJECTS)
+        if call_type == 'importance':
+            items = re.findall(r'^(\d+)\. ', content, re.M) # batched rating prompt
+            return '\n'.join(f'{item}: {rng.randint(1, 10)}' for item in items) if items else f'Rating: {rng.randint(1, 10)}'
+        if call_type == 'questions':
+            return '\n'.join(f'What does everyone think about {s}?' for s in rng.sample(MockBackend.SUBJECTS, 3))
+        if call_type == 'emotion':
+            return str(rng.randint(-10, 10))
+        if call_type == 'summary':
+            return '\n'.join(f'They talked about {s}.' for s in rng.sample(MockBackend.SUBJECTS, rng.randint(2, 3)))
+        if call_type == 'dialogue':
+            match = re.search(r'You are (.+?)\. How would you respond\?', content)
+            name = match.group(1) if match else 'Stranger'
+            return f'{name}: Have you heard the news about {subject}?'
+        return f'It all comes back to {subject}.'
+
+    def complete(self, model: str, message_stream: List[Dict]) -> str:
+        call_type = self.call_type(message_stream)
+        time.sleep(self.delay(call_type))
+        return self.respond(call_type, message_stream)
+
+    def complete_stream(self, model: str, message_stream: List[Dict]) -> Iterator[str]:
+        """Yield the templated response word by word; the call type's latency is spent before the first word."""
+        call_type = self.call_type(message_stream)
+        time.sleep(self.delay(call_type))
+        yield from re.findall(r'\S+\s*', self.respond(call_type, message_stream))
+
+    def embedding(self, model: str, texts: List[str], dimensions: int) -> np.ndarray:
+        time.sleep(self.delay('embedding'))
+        return self.embed(model, texts, dimensions)
+
+    async def acomplete(self, model: str, message_stream: List[Dict]) -> str:
+        call_type = self.call_type(message_stream)
+        await asyncio.sleep(self.delay(call_type))
+        return self.respond(call_type, message_stream)
+
+    async def aembedding(self, model: str, texts: List[str], dimensions: int) -> np.ndarray:
+        await asyncio.sleep(self.delay('embedding'))
+        return self.embed(model, texts, dimensions)
+
+    def embed(self, model: str, texts: List[str], dimensions: int) -> np.ndarray:
+        vectors = np.empty((len(texts), dimensions))
+        for i, text in enumerate(texts):
+            digest = hashlib.sha256(f'{self.seed}\x00{model}\x00{text}'.encode()).digest()
+            vectors[i] = np.random.default_rng(int.from_bytes(digest[:8], 'little')).standard_normal(dimensions)
+        return vectors / np.linalg.norm(vectors, axis=1, keepdims=True)
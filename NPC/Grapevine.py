@@ -1,9 +1,15 @@
 from random import choice, randint, gauss
+from bisect import bisect_right
 from collections import deque
-from typing import Dict, List, Tuple
+from typing import Callable, Dict, Iterator, List, Tuple
 from GPTEndpoint import GPTEndpoint
+from UsageTracker import UsageTracker
+from Log import Log
 from NPC.NPC import NPC
-import time, re
+from NPC.Memory import Memory
+from NPC.utils import map_concurrently
+import time, re, json
+import numpy as np
 
 from NPC.Prompts import Prompts
 
@@ -34,52 +40,62 @@ class Grapevine:
                 (b) Every conversation the NPC has with the PLAYER updates
                     (i) Dxy (by rate of convo)
                     (ii) Exy (by sentiment analysis)
-                (c) TODO: Every WITNESS event (robbery, murder, heroics) is processed in a buffer
+                (c) Every WITNESS event (robbery, murder, heroics) is processed in a buffer (see witness)
                     (i) Every in-game day, information is diffused reigonally from the buffer
+                    (ii) An event starts at its witnesses with strength importance / 10 (or one edge out from its origins,
+                         e.g. a murder victim), and loses a factor of WITNESS_DECAY * Dxy / 10 crossing each edge; it is
+                         passed on, and heard as a rumor, by every living NPC where its strength stays above WITNESS_THRESHOLD
+                         (one vectorized propagation over every queued event, no conversations). Witnesses always remember it
+                    (iii) Every reached NPC remembers the events it saw or heard of in one bulk memory write
             (4) Information diffusion from one NPC to another
                 (a) Every in-game day, an Info Diffusion process is run, consisting of the following:
                     (i) If Dxy > N(5,2), where N is a normal R.V, then trigger a conversation
                     (ii) A natural conversation is simulated via LLM between X and Y
                     (ii) The length of the conversation will be determined by Exy
-                    (iv) X and Y will both reflect on this conversation
+                    (iv) X and Y will both reflect on this conversation (once enough has happened; see NPC.maybe_reflect)
                     (v) Updates Dxy by keeping track of rate of conversation
                     (vi) Updates Exy by analyzing sentiment of conversation
             (5) TODO: Dealing with the loss or gain of NPCs
                 (a) Losses of NPCs in the network leave people with high Dxy's to wonder what happened
                 (b) An addition of a new NPC Z automatically triggers convo's with others connected to Z
-            (6) TODO: Miscellanious Functions
+            (6) Miscellanious Functions
                 (a) get_subset_by_strength(V, thresh)
                     (i) V is a specific NPC or PLAYER, and thresh is a number in [1, 10]
                     (ii) Creates a new Grapevine localized to V and every node N connected to V with Dvn > thresh
                 (b) get_subset_by_emotion(V, thresh)
                     (i) Similar to get_subset_by_emotion but now Evn > thresh
+                (c) Both are a binary search over V's neighbors sorted by weight (cached per node, dropped when one of V's
+                    edges is updated) and return a Subset view of this Grapevine, so they are cheap enough to call every frame
     '''
 
     class Edge:
         '''
             Edge class representing a directed edge to another NPC / player with edge weights Dxy and Exy
 
-            Has functions to help update Dxy and Exy
+            Has functions to help update Dxy and Exy (on_update, if given, is called after each update)
         '''
         BUFFER_SIZE = 4
 
-        def __init__(self, x: str, y: str, D: float, E: float) -> None:
+        def __init__(self, x: str, y: str, D: float, E: float, on_update: Callable[['Grapevine.Edge'], None] = None) -> None:
             self.x = x
             self.y = y
             self.D = D
             self.E = E
+            self.on_update = on_update
 
             # Keep last 4 weights as buffer
             self.D_buffer = deque(maxlen=Grapevine.Edge.BUFFER_SIZE)
             self.E_buffer = deque(maxlen=Grapevine.Edge.BUFFER_SIZE)
         
         def update_distance(self, newD: float) -> None:
-            self.E_buffer.append(newD)
-            self.E = sum(self.D_buffer) / len(self.D_buffer)
+            self.D_buffer.append(newD)
+            self.D = sum(self.D_buffer) / len(self.D_buffer)
+            if self.on_update: self.on_update(self)
 
         def update_emotion(self, newE: float) -> None:
             self.E_buffer.append(newE)
             self.E = sum(self.E_buffer) / len(self.E_buffer)
+            if self.on_update: self.on_update(self)
         
         def get_weights(self) -> Tuple[float, float]:
             return (self.D, self.E)
@@ -96,43 +112,304 @@ class Grapevine:
 
 
 
-    def __init__(self, player: str, NPC_nodes: List[NPC], edges: List[Tuple[str, str, float, float]], LLM: GPTEndpoint) -> None:
+    class Subset:
+        '''
+            A view of the part of a Grapevine localized to a center node V: V and the given neighbors. Nothing is copied;
+            subset.grapevine[x] lists x's edges to other members of the subset, read from the full Grapevine when accessed
+        '''
+
+        def __init__(self, parent: 'Grapevine', center: str, neighbors: List[str]) -> None:
+            self.parent = parent
+            self.player = parent.player
+            self.center = center
+            self.nodes = [center] + neighbors # neighbors in decreasing weight
+            self.node_set = None # built on first membership test
+
+        def __contains__(self, name: str) -> bool:
+            if self.node_set is None: self.node_set = set(self.nodes)
+            return name in self.node_set
+
+        def __iter__(self) -> Iterator[str]:
+            return iter(self.nodes)
+
+        def __len__(self) -> int:
+            return len(self.nodes)
+
+        @property
+        def grapevine(self) -> 'Grapevine.Subset':
+            return self
+
+        def __getitem__(self, x: str) -> Dict[str, 'Grapevine.Edge']:
+            assert x in self, f'{x} is not in this subset.'
+            return {y: edge for y, edge in self.parent.grapevine[x].items() if y in self}
+
+        def get_NPC(self, npc_name: str = None) -> NPC:
+            if npc_name is None:
+                return self.parent.get_NPC(choice([name for name in self.nodes if name != self.player]))
+            return self.parent.get_NPC(npc_name) if npc_name in self else None
+
+        def get_subset_by_strength(self, V: str, thresh: float) -> 'Grapevine.Subset':
+            return Grapevine.Subset(self.parent, V, [name for name in self.parent.neighbors_above(V, 'D', thresh) if name in self])
+
+        def get_subset_by_emotion(self, V: str, thresh: float) -> 'Grapevine.Subset':
+            return Grapevine.Subset(self.parent, V, [name for name in self.parent.neighbors_above(V, 'E', thresh) if name in self])
+
+    WITNESS_DECAY = 0.8 # share of an event's strength carried across an edge with Dxy = 10
+    WITNESS_THRESHOLD = 0.3 # min strength at which an event is passed on by (and heard as a rumor by) an NPC
+
+    def __init__(self, player: str, NPC_nodes: List[NPC], edges: List[Tuple[str, str, float, float]], LLM: GPTEndpoint, log: Log = None, max_workers: int = 8,
+                 clock: Callable[[], float] = time.time) -> None:
         '''
             Initializes the Grapevine with:
                 - player: The name of the PLAYER
                 - NPC_nodes: A list of NPCs 
                 - edges: A list of edges, where each edge is:
                     - (x, y, Dxy, Exy)
+                - log: if given, the LLM usage of every tick is written to it
+                - max_workers: max conversations simulated at once (see schedule_conversations)
+                - clock: returns the current time (read once per tick); pass a deterministic clock to make ticks repeatable,
+                  e.g. to replay them from a ReplayStore
         '''
         # TODO: Add assertions to the edges' Dxy and Exy
         self.player = player
         self.name_to_NPC = {npc.name:npc for npc in NPC_nodes}
         self.LLM = LLM
+        self.log = log
+        self.max_workers = max_workers
+        self.clock = clock
+        self.witness_events: List[Tuple[str, List[str], int, float, List[str]]] = [] # (description, witnesses, importance, timestamp, origins)
         
         # Init Grapevine graph
+        self.neighbor_index: Dict[Tuple[str, str], Tuple[List[float], List[str]]] = {} # (V, 'D' / 'E') -> V's neighbors sorted by weight
         self.grapevine: Dict[str, Dict[str, Grapevine.Edge]] = {npc.name:{} for npc in NPC_nodes}
         self.grapevine[player] = {}
         for edge in edges:
             x, y, Dxy, Exy = edge
             assert x in self.grapevine and y in self.grapevine and 0 <= Dxy <= 10 and -10 <= Exy <= 10
-            self.grapevine[x][y] = Grapevine.Edge(x, y, Dxy, Exy)
+            self.grapevine[x][y] = Grapevine.Edge(x, y, Dxy, Exy, on_update=self.invalidate_neighbors)
     
     def get_NPC(self, npc_name:str=None) -> NPC:
         if npc_name is None:
             return choice(list(self.name_to_NPC.values()))
         return self.name_to_NPC[npc_name] if npc_name in self.name_to_NPC else None
 
+    def get_subset_by_strength(self, V: str, thresh: float) -> 'Grapevine.Subset':
+        '''
+            V and every node N connected to V with Dvn > thresh, as a Subset view (strongest connections first)
+        '''
+        return Grapevine.Subset(self, V, self.neighbors_above(V, 'D', thresh))
+
+    def get_subset_by_emotion(self, V: str, thresh: float) -> 'Grapevine.Subset':
+        '''
+            V and every node N connected to V with Evn > thresh, as a Subset view (warmest feelings first)
+        '''
+        return Grapevine.Subset(self, V, self.neighbors_above(V, 'E', thresh))
+
+    def neighbors_above(self, V: str, weight: str, thresh: float) -> List[str]:
+        '''
+            Neighbors N of V with weight ('D' or 'E') of V -> N above thresh, highest first: a binary search in V's sorted neighbors
+        '''
+        weights, names = self.sorted_neighbors(V, weight)
+        return names[bisect_right(weights, thresh):][::-1]
+
+    def sorted_neighbors(self, V: str, weight: str) -> Tuple[List[float], List[str]]:
+        '''
+            (weights, names) of V's neighbors in increasing weight, cached until one of V's edges changes
+        '''
+        if (V, weight) not in self.neighbor_index:
+            edges = sorted(self.grapevine[V].values(), key=lambda edge: getattr(edge, weight))
+            self.neighbor_index[(V, weight)] = ([getattr(edge, weight) for edge in edges], [edge.y for edge in edges])
+        return self.neighbor_index[(V, weight)]
+
+    def invalidate_neighbors(self, edge: 'Grapevine.Edge') -> None:
+        self.neighbor_index.pop((edge.x, 'D'), None)
+        self.neighbor_index.pop((edge.x, 'E'), None)
+
+    def snapshot(self, path: str) -> None:
+        '''
+            Writes the whole world (every NPC, plus the edges with their weight buffers) to a single .npz file
+        '''
+        names = list(self.grapevine)
+        name_index = {name: i for i, name in enumerate(names)}
+        edges = [edge for x in self.grapevine for edge in self.grapevine[x].values()]
+        buffers = np.full((2, len(edges), Grapevine.Edge.BUFFER_SIZE), np.nan)
+        for i, edge in enumerate(edges):
+            buffers[0, i, :len(edge.D_buffer)] = edge.D_buffer
+            buffers[1, i, :len(edge.E_buffer)] = edge.E_buffer
+        state = {'player': self.player, 'names': names, 'NPCs': list(self.name_to_NPC), 'witness_events': self.witness_events}
+        arrays = {'grapevine': np.frombuffer(json.dumps(state).encode('utf-8'), dtype=np.uint8),
+                  'edge_nodes': np.array([[name_index[edge.x], name_index[edge.y]] for edge in edges], dtype=np.int64).reshape(-1, 2),
+                  'edge_weights': np.array([edge.get_weights() for edge in edges], dtype=np.float64).reshape(-1, 2),
+                  'edge_buffers': buffers}
+        for i, npc in enumerate(self.name_to_NPC.values()):
+            arrays.update(npc.snapshot_arrays(prefix=f'npc{i}.'))
+        np.savez(path, **arrays)
+
+    @classmethod
+    def restore(cls, path: str, LLM: GPTEndpoint, log: Log = None, clock: Callable[[], float] = time.time) -> 'Grapevine':
+        '''
+            Loads a world written by snapshot, without any LLM or embedding calls. NPCs that shared a SharedMemoryIndex
+            share one again
+        '''
+        with np.load(path) as npz:
+            arrays = {key: npz[key] for key in npz.files}
+        state = json.loads(arrays['grapevine'].tobytes().decode('utf-8'))
+        NPC_log = log if log is not None else Log(disabled=True)
+        shared_indexes = {}
+        NPCs = [NPC.restore_arrays(arrays, LLM, NPC_log, prefix=f'npc{i}.', shared_indexes=shared_indexes) for i in range(len(state['NPCs']))]
+        names = state['names']
+        edges = [(names[x], names[y], D, E) for (x, y), (D, E) in zip(arrays['edge_nodes'].tolist(), arrays['edge_weights'].tolist())]
+        grapevine = cls(state['player'], NPCs, edges, LLM, log, clock=clock)
+        for (x, y), D_buffer, E_buffer in zip(arrays['edge_nodes'].tolist(), arrays['edge_buffers'][0], arrays['edge_buffers'][1]):
+            edge = grapevine.grapevine[names[x]][names[y]]
+            for D in D_buffer[~np.isnan(D_buffer)].tolist(): edge.update_distance(D) # replaying the buffer restores the averages
+            for E in E_buffer[~np.isnan(E_buffer)].tolist(): edge.update_emotion(E)
+        grapevine.witness_events = [tuple(event) for event in state.get('witness_events', [])]
+        return grapevine
+
+    def witness(self, description: str, witnesses: List[str], importance: int = 8, timestamp: float = None, origins: List[str] = None) -> None:
+        '''
+            Queues a WITNESS event (robbery, murder, heroics) seen by the given NPCs, to be diffused at the next tick
+                - importance: in [1, 10]; the importance of the witnesses' memories, and how far the event spreads (events
+                  below WITNESS_THRESHOLD * 10 are only remembered by their witnesses)
+                - timestamp: when it happened (default now)
+                - origins: NPCs the news spreads out from without them remembering it (e.g. a murder victim): it starts
+                  at their neighbors, as if an origin had passed it on, and never comes back to them
+        '''
+        origins = [] if origins is None else list(origins)
+        assert all(name in self.name_to_NPC for name in witnesses + origins) and 1 <= importance <= 10
+        self.witness_events.append((description, list(witnesses), importance, self.clock() if timestamp is None else timestamp, origins))
+
+    def kill(self, name: str, importance: int = 10, timestamp: float = None) -> None:
+        '''
+            Marks an NPC dead (it no longer passes on or hears WITNESS events) and queues the news of its murder, which nobody
+            saw: it spreads out from the victim's neighbors at the next tick
+        '''
+        self.name_to_NPC[name].is_alive = False
+        self.witness(f'{name} was found murdered.', [], importance, timestamp, origins=[name])
+
+    def diffuse_witness_events(self) -> Dict[str, int]:
+        '''
+            Spreads every queued WITNESS event over the NPC edges and empties the queue. Each reached NPC records what it
+            witnessed or heard in one record_many call (importance: the event's strength there, out of 10).
+            Dead NPCs (is_alive False) and an event's origins neither pass it on nor remember it.
+            Returns the number of events delivered to each reached NPC
+        '''
+        if not self.witness_events:
+            return {}
+        events, self.witness_events = self.witness_events, []
+        names, src, dst, D = self.witness_edges()
+        name_index = {name: i for i, name in enumerate(names)}
+        weights = Grapevine.WITNESS_DECAY * D / 10
+        strength = np.zeros((len(events), len(names)))
+        witnessed = np.zeros(strength.shape, dtype=bool)
+        blocked = np.zeros(strength.shape, dtype=bool)
+        blocked[:, [node for node, name in enumerate(names) if not self.name_to_NPC[name].is_alive]] = True
+        for i, (_, witnesses, importance, _, origins) in enumerate(events):
+            witnessed[i, [name_index[witness] for witness in witnesses]] = True
+            blocked[i, [name_index[origin] for origin in origins]] = True
+            strength[i, witnessed[i]] = importance / 10
+            from_origins = np.isin(src, [name_index[origin] for origin in origins])
+            np.maximum.at(strength[i], dst[from_origins], importance / 10 * weights[from_origins])
+        strength[blocked] = 0
+        witnessed &= ~blocked
+        reach = self.propagate(strength, src, dst, weights, Grapevine.WITNESS_THRESHOLD, blocked)
+        reach[witnessed] = np.maximum(reach[witnessed], strength[witnessed]) # even events too minor to pass on
+
+        deliveries: Dict[str, Tuple[List[str], List[float], List[int]]] = {}
+        for i, node in zip(*np.nonzero(reach)):
+            description, witnesses, _, timestamp, _ = events[i]
+            name = names[node]
+            texts, timestamps, importances = deliveries.setdefault(name, ([], [], []))
+            texts.append(f'{name} witnessed this: {description}' if name in witnesses else f'{name} heard a rumor: {description}')
+            timestamps.append(timestamp)
+            importances.append(max(1, int(round(10 * reach[i, node]))))
+        map_concurrently(lambda delivery: self.deliver_witness_memories(*delivery), list(deliveries.items()), self.max_workers)
+        if self.log is not None:
+            self.log.log(f'Diffused {len(events)} witness events to {len(deliveries)} NPCs.')
+        return {name: len(texts) for name, (texts, _, _) in deliveries.items()}
+
+    def deliver_witness_memories(self, name: str, memories: Tuple[List[str], List[float], List[int]]) -> None:
+        texts, timestamps, importances = memories
+        self.name_to_NPC[name].memory.record_many(texts, timestamps, force_commit=True, memory_importances=importances)
+
+    def witness_edges(self) -> Tuple[List[str], np.ndarray, np.ndarray, np.ndarray]:
+        '''
+            (names, src, dst, D) of the edges between NPCs (the player passes nothing on), src / dst as positions in names
+        '''
+        names = list(self.name_to_NPC)
+        name_index = {name: i for i, name in enumerate(names)}
+        edges = [edge for x in names for edge in self.grapevine[x].values() if edge.y in name_index]
+        return (names, np.array([name_index[edge.x] for edge in edges], dtype=np.int64),
+                np.array([name_index[edge.y] for edge in edges], dtype=np.int64), np.array([edge.D for edge in edges], dtype=np.float64))
+
+    @staticmethod
+    def propagate(strength: np.ndarray, src: np.ndarray, dst: np.ndarray, weights: np.ndarray, threshold: float, blocked: np.ndarray = None) -> np.ndarray:
+        '''
+            strength: (events, nodes) initial strengths. Each hop, node y takes the max over its edges x -> y of
+            strength[x] * weight, dropped below threshold, until nothing changes. Returns the final strengths (0 = not reached)
+            blocked: optional (events, nodes) mask of nodes an event never reaches (so never passes on)
+        '''
+        order = np.argsort(dst, kind='stable')
+        src, dst, weights = src[order], dst[order], weights[order]
+        strength = np.ascontiguousarray(np.where(strength >= threshold, strength, 0).T) # (nodes, events): edge rows are contiguous
+        if blocked is not None:
+            blocked = np.ascontiguousarray(blocked.T)
+            strength[blocked] = 0
+        changed = strength.any(axis=1)
+        for _ in range(len(strength)): # a strongest path visits each node at most once
+            active = np.flatnonzero(changed[src]) # only edges out of nodes that changed last hop can raise anything
+            if len(active) == 0:
+                break
+            targets, starts = np.unique(dst[active], return_index=True)
+            incoming = np.maximum.reduceat(strength[src[active]] * weights[active, None], starts, axis=0)
+            incoming[incoming < threshold] = 0
+            if blocked is not None: incoming[blocked[targets]] = 0
+            raised = incoming > strength[targets]
+            changed = np.zeros(len(strength), dtype=bool)
+            changed[targets] = raised.any(axis=1)
+            strength[targets] = np.where(raised, incoming, strength[targets])
+        return strength.T
+
     def tick_info_diffusion(self) -> None:
         '''
         Process for all pairs of NPCs
             (i) If Dxy > N(5,2), where N is a normal R.V, then trigger a conversation
             (ii) A natural conversation is simulated via LLM between X and Y
             (ii) The length of the conversation will be determined by Exy
-            (iv) X and Y will both reflect on this conversation
+            (iv) X and Y will both reflect on this conversation (once enough has happened; see NPC.maybe_reflect)
             (v) Updates Dxy by keeping track of rate of conversation
             (vi) Updates Exy by analyzing sentiment of conversation
+        The WITNESS events queued since the last tick are diffused first (see diffuse_witness_events).
+        Conversations are grouped into rounds of disjoint pairs (see schedule_conversations); the conversations of a round
+        run concurrently, so a tick takes as long as its rounds rather than its pairs.
+        The clock is read once: every conversation, emotion update and consolidation of the tick happens at that time.
+        '''
+        current_time = self.clock()
+        self.diffuse_witness_events()
+        pairs = self.sample_conversations()
+
+        # Simulate the conversations, one round of disjoint pairs at a time
+        for conversation_round in self.schedule_conversations(pairs):
+            map_concurrently(lambda pair: self.simulate_conversation(*pair, current_time=current_time), conversation_round, self.max_workers)
+        conversed_edges = [edge for x, y, _ in pairs for edge in (self.grapevine[x][y], self.grapevine[y][x])]
+
+        # Update weights (all memory retrievals of the tick run as one batched query)
+        self.update_NPC_emotions(conversed_edges, current_time)
+
+        # Keep every NPC's memory under its caps (no-op for unbounded memories)
+        for npc in self.name_to_NPC.values():
+            npc.memory.consolidate(current_time)
+
+        if self.log is not None:
+            UsageTracker.export(self.log, 'tick', self.LLM.usage.tick_report())
+
+    def sample_conversations(self) -> List[Tuple[str, str, float]]:
+        '''
+            Picks the conversations (x, y, Exy) of a tick: every pair of NPCs connected by an edge, once, if Dxy > N(5,2)
         '''
         processed_conversations = set()
+        pairs = []
         # TODO: Process NPCs in a random order
         for x in self.grapevine:
             for y in self.grapevine[x]:
@@ -151,37 +428,73 @@ class Grapevine:
                 if not self.does_convo_occur(Dxy):
                     continue
 
-                # Simulate dialogue between NPC 1 and NPC 2
-                NPC_1, NPC_2 = self.name_to_NPC[x], self.name_to_NPC[y]
-                dialogue_history = ["Hello!"]
-                for i in range(self.calc_convo_length(Exy)):
-                    dialogue_history.append(NPC_1.dialogue(f'{x} is conversing with {y}', dialogue_history, y, time.time()))
-                    dialogue_history.append(NPC_2.dialogue(f'{y} is conversing with {x}', dialogue_history, x, time.time()))
-                NPC_1.reflect(time.time())
-                NPC_2.reflect(time.time())
-
-                # Update weights
-                self.update_NPC_emotion(self.grapevine[x][y])
-                self.update_NPC_emotion(self.grapevine[y][x])
+                pairs.append((x, y, Exy))
+        return pairs
     
 
+    def schedule_conversations(self, pairs: List[Tuple[str, str, float]]) -> List[List[Tuple[str, str, float]]]:
+        '''
+            Groups conversations (x, y, Exy) into rounds where no NPC is in two conversations (greedy first fit, in order)
+        '''
+        rounds, busy = [], []
+        for pair in pairs:
+            x, y, _ = pair
+            for conversation_round, names in zip(rounds, busy):
+                if x not in names and y not in names:
+                    break
+            else:
+                conversation_round, names = [], set()
+                rounds.append(conversation_round)
+                busy.append(names)
+            conversation_round.append(pair)
+            names.update((x, y))
+        return rounds
+
+    def simulate_conversation(self, x: str, y: str, Exy: float, current_time: float = None) -> List[str]:
+        '''
+            Simulates a dialogue between NPCs X and Y (at current_time, default the clock's time), after which both may reflect.
+            Returns the dialogue history
+        '''
+        current_time = self.clock() if current_time is None else current_time
+        NPC_1, NPC_2 = self.name_to_NPC[x], self.name_to_NPC[y]
+        dialogue_history = ["Hello!"]
+        for i in range(self.calc_convo_length(Exy)):
+            dialogue_history.append(NPC_1.dialogue(f'{x} is conversing with {y}', dialogue_history, y, current_time))
+            dialogue_history.append(NPC_2.dialogue(f'{y} is conversing with {x}', dialogue_history, x, current_time))
+        NPC_1.end_conversation(y)
+        NPC_2.end_conversation(x)
+        NPC_1.maybe_reflect(current_time)
+        NPC_2.maybe_reflect(current_time)
+        return dialogue_history
+
     def update_NPC_emotion(self, edge:Edge) -> None:
         '''
             Updates Exy by analyzing how X feels about Y (X and Y are both NPCs)
         '''
-        # print(self.grapevine)
-        perciever = self.name_to_NPC[edge.x]
-        queried_memories = perciever.memory.query(f'What are your thoughts on {edge.y}', 3, time.time())
-        emotion_level = get_first_number(perciever.LLM.complete(message_stream=[{'role':'user', 'content': perciever.prompt.emotion_level(edge.y, queried_memories)}]))
-        if emotion_level is not None:
-            edge.update_emotion(emotion_level)
+        self.update_NPC_emotions([edge])
+
+    def update_NPC_emotions(self, edges:List[Edge], current_time: float = None) -> None:
+        '''
+            Updates Exy for several edges, fetching every perceiver's memories in one batched query and rating them concurrently
+        '''
+        current_time = self.clock() if current_time is None else current_time
+        percievers = [self.name_to_NPC[edge.x] for edge in edges]
+        all_queried_memories = Memory.query_many([(perciever.memory, f'What are your thoughts on {edge.y}', 3) for perciever, edge in zip(percievers, edges)], current_time)
+        responses = map_concurrently(lambda request: request[0].LLM.complete(message_stream=[{'role':'user', 'content': request[0].prompt.emotion_level(request[1].y, request[2])}],
+                                                                             phase='emotion', caller=request[0].name),
+                                     list(zip(percievers, edges, all_queried_memories)), self.max_workers)
+        for edge, response in zip(edges, responses):
+            emotion_level = get_first_number(response)
+            if emotion_level is not None:
+                edge.update_emotion(emotion_level)
 
     def update_player_emotion(self, reciever:NPC, dialogue_history:List[str]) -> None:
         '''
             Updates Exy by analyzing how PLAYER feels about Y and vice versa
         '''
         # Update player -> reciever
-        emotion_level = get_first_number(self.LLM.complete(message_stream=[{'role':'user', 'content': Prompts.player_emotion_level(self.player, reciever, dialogue_history)}]))
+        emotion_level = get_first_number(self.LLM.complete(message_stream=[{'role':'user', 'content': Prompts.player_emotion_level(self.player, reciever, dialogue_history)}],
+                                                            phase='emotion', caller=self.player))
         if emotion_level is not None:
             self.grapevine[self.player][reciever.name].update_emotion(emotion_level)
 
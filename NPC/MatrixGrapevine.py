@@ -0,0 +1,218 @@
+import time
+import numpy as np
+from typing import Callable, Dict, Iterator, List, Tuple
+from GPTEndpoint import GPTEndpoint
+from Log import Log
+from NPC.NPC import NPC
+from NPC.Grapevine import Grapevine
+
+class MatrixGrapevine(Grapevine):
+    '''
+        A Grapevine whose edges live in NumPy arrays instead of Edge objects, for worlds with thousands of NPCs.
+
+        Edges are stored sparsely (COO, sorted by (x, y)): src / dst node numbers, D and E weights, and the last
+        Edge.BUFFER_SIZE updates of each weight in ring buffers updated in place. Conversations for a tick are sampled for
+        every pair in one vectorized draw. self.grapevine[x][y] still gives an Edge-like view, so the rest of Grapevine
+        (conversations, emotion updates, snapshots) works unchanged.
+    '''
+
+    class EdgeView:
+        '''
+            Edge-like view of one edge of a MatrixGrapevine (reads and updates go to the arrays)
+        '''
+
+        def __init__(self, graph: 'MatrixGrapevine', idx: int) -> None:
+            self.graph = graph
+            self.idx = idx
+
+        @property
+        def x(self) -> str:
+            return self.graph.names[self.graph.src[self.idx]]
+
+        @property
+        def y(self) -> str:
+            return self.graph.names[self.graph.dst[self.idx]]
+
+        @property
+        def D(self) -> float:
+            return float(self.graph.D[self.idx])
+
+        @property
+        def E(self) -> float:
+            return float(self.graph.E[self.idx])
+
+        @property
+        def D_buffer(self) -> List[float]:
+            return self.graph.buffered(self.graph.D_buffer, self.graph.D_count, self.graph.D_next, self.idx)
+
+        @property
+        def E_buffer(self) -> List[float]:
+            return self.graph.buffered(self.graph.E_buffer, self.graph.E_count, self.graph.E_next, self.idx)
+
+        def update_distance(self, newD: float) -> None:
+            self.graph.update_distances(np.array([self.idx]), np.array([newD]))
+
+        def update_emotion(self, newE: float) -> None:
+            self.graph.update_emotions(np.array([self.idx]), np.array([newE]))
+
+        def get_weights(self) -> Tuple[float, float]:
+            return (self.D, self.E)
+
+        def __eq__(self, other) -> bool:
+            return (self.x == other.x) and (self.y == other.y)
+
+        def __hash__(self) -> int:
+            return hash((self.x, self.y))
+
+        def __repr__(self) -> str:
+            return f"{self.x} -> {self.y} | D,E = {self.D},{self.E}"
+
+    class Adjacency:
+        '''
+            Read-only stand-in for Grapevine.grapevine: adjacency[x][y] -> EdgeView, iteration over node names
+        '''
+
+        def __init__(self, graph: 'MatrixGrapevine') -> None:
+            self.graph = graph
+
+        def __getitem__(self, x: str) -> Dict[str, 'MatrixGrapevine.EdgeView']:
+            node = self.graph.name_index[x]
+            edges = range(self.graph.row_start[node], self.graph.row_start[node + 1])
+            return {self.graph.names[self.graph.dst[idx]]: MatrixGrapevine.EdgeView(self.graph, idx) for idx in edges}
+
+        def __contains__(self, x: str) -> bool:
+            return x in self.graph.name_index
+
+        def __iter__(self) -> Iterator[str]:
+            return iter(self.graph.names)
+
+        def __len__(self) -> int:
+            return len(self.graph.names)
+
+    def __init__(self, player: str, NPC_nodes: List[NPC], edges: List[Tuple[str, str, float, float]], LLM: GPTEndpoint,
+                 log: Log = None, max_workers: int = 8, clock: Callable[[], float] = time.time, seed: int = None) -> None:
+        '''
+            Same arguments as Grapevine, plus:
+                - seed: seed of the generator used to sample conversations
+        '''
+        self.player = player
+        self.name_to_NPC = {npc.name:npc for npc in NPC_nodes}
+        self.LLM = LLM
+        self.log = log
+        self.max_workers = max_workers
+        self.clock = clock
+        self.rng = np.random.default_rng(seed)
+        self.witness_events = []
+
+        # Nodes: NPCs in the given order, then the player
+        self.names = [npc.name for npc in NPC_nodes] + [player]
+        self.name_index = {name: i for i, name in enumerate(self.names)}
+
+        # Edges (COO, sorted by src then dst)
+        src = np.array([self.name_index[x] for x, _, _, _ in edges], dtype=np.int64)
+        dst = np.array([self.name_index[y] for _, y, _, _ in edges], dtype=np.int64)
+        D = np.array([Dxy for _, _, Dxy, _ in edges], dtype=np.float64)
+        E = np.array([Exy for _, _, _, Exy in edges], dtype=np.float64)
+        assert np.all((0 <= D) & (D <= 10)) and np.all((-10 <= E) & (E <= 10))
+        order = np.argsort(src * len(self.names) + dst, kind='stable')
+        self.src, self.dst, self.D, self.E = src[order], dst[order], D[order], E[order]
+        self.keys = self.src * len(self.names) + self.dst
+        assert len(np.unique(self.keys)) == len(self.keys), 'Duplicate edge.'
+        self.row_start = np.searchsorted(self.src, np.arange(len(self.names) + 1))
+
+        # Ring buffers of the last BUFFER_SIZE updates of each weight
+        size = Grapevine.Edge.BUFFER_SIZE
+        self.D_buffer, self.E_buffer = np.zeros((len(self.keys), size)), np.zeros((len(self.keys), size))
+        self.D_count, self.E_count = np.zeros(len(self.keys), dtype=np.int8), np.zeros(len(self.keys), dtype=np.int8)
+        self.D_next, self.E_next = np.zeros(len(self.keys), dtype=np.int8), np.zeros(len(self.keys), dtype=np.int8)
+
+        # One edge per NPC pair, as the dict walk of Grapevine.sample_conversations would visit it (x -> y with x first
+        # in node order if that edge exists, else y -> x)
+        player_idx = self.name_index[player]
+        candidates = np.flatnonzero((self.src != player_idx) & (self.dst != player_idx))
+        pair_keys = np.minimum(self.src, self.dst)[candidates] * len(self.names) + np.maximum(self.src, self.dst)[candidates]
+        order = np.lexsort((self.src[candidates] > self.dst[candidates], pair_keys))
+        _, first = np.unique(pair_keys[order], return_index=True)
+        self.pair_edges = candidates[order[first]]
+
+        self.neighbor_index = {} # (V, 'D' / 'E') -> V's neighbors sorted by weight
+        self.grapevine = MatrixGrapevine.Adjacency(self)
+
+    def edge_indices(self, xs: np.ndarray, ys: np.ndarray) -> np.ndarray:
+        '''
+            Positions of the edges x -> y (node numbers) in the edge arrays, -1 where there is no such edge
+        '''
+        keys = np.asarray(xs, dtype=np.int64) * len(self.names) + np.asarray(ys, dtype=np.int64)
+        positions = np.minimum(np.searchsorted(self.keys, keys), max(len(self.keys) - 1, 0))
+        return np.where((len(self.keys) > 0) & (self.keys[positions] == keys), positions, -1)
+
+    def sample_conversations(self) -> List[Tuple[str, str, float]]:
+        '''
+            Picks the conversations (x, y, Exy) of a tick: one N(5,2) draw for every NPC pair at once
+        '''
+        occurs = self.D[self.pair_edges] > self.rng.normal(5, 2, len(self.pair_edges)) - 5
+        chosen = self.pair_edges[occurs]
+        return [(self.names[x], self.names[y], E) for x, y, E in zip(self.src[chosen].tolist(), self.dst[chosen].tolist(), self.E[chosen].tolist())]
+
+    def update_distances(self, edges: np.ndarray, values: np.ndarray) -> None:
+        '''
+            Pushes new Dxy values for several edges (positions in the edge arrays); Dxy becomes the mean of its buffer
+        '''
+        self.push(self.D_buffer, self.D_count, self.D_next, self.D, edges, values)
+        self.invalidate_rows(self.src[edges])
+
+    def update_emotions(self, edges: np.ndarray, values: np.ndarray) -> None:
+        '''
+            Pushes new Exy values for several edges (positions in the edge arrays); Exy becomes the mean of its buffer
+        '''
+        self.push(self.E_buffer, self.E_count, self.E_next, self.E, edges, values)
+        self.invalidate_rows(self.src[edges])
+
+    def witness_edges(self) -> Tuple[List[str], np.ndarray, np.ndarray, np.ndarray]:
+        '''
+            (names, src, dst, D) of the edges between NPCs, straight from the edge arrays (the player is the last name)
+        '''
+        player_idx = self.name_index[self.player]
+        between_NPCs = (self.src != player_idx) & (self.dst != player_idx)
+        return self.names[:player_idx], self.src[between_NPCs], self.dst[between_NPCs], self.D[between_NPCs]
+
+    def sorted_neighbors(self, V: str, weight: str) -> Tuple[List[float], List[str]]:
+        '''
+            (weights, names) of V's neighbors in increasing weight, sorted from V's slice of the edge arrays
+        '''
+        if (V, weight) not in self.neighbor_index:
+            node = self.name_index[V]
+            start, end = self.row_start[node], self.row_start[node + 1]
+            weights = (self.D if weight == 'D' else self.E)[start:end]
+            order = np.argsort(weights, kind='stable')
+            self.neighbor_index[(V, weight)] = (weights[order].tolist(), [self.names[y] for y in self.dst[start:end][order].tolist()])
+        return self.neighbor_index[(V, weight)]
+
+    def invalidate_rows(self, rows: np.ndarray) -> None:
+        if len(rows) >= len(self.neighbor_index):
+            self.neighbor_index.clear()
+            return
+        for row in np.unique(rows).tolist():
+            self.neighbor_index.pop((self.names[row], 'D'), None)
+            self.neighbor_index.pop((self.names[row], 'E'), None)
+
+    @staticmethod
+    def push(buffer: np.ndarray, count: np.ndarray, next_slot: np.ndarray, weights: np.ndarray, edges: np.ndarray, values: np.ndarray) -> None:
+        edges, values = np.asarray(edges, dtype=np.int64), np.asarray(values, dtype=np.float64)
+        if len(edges) > 1 and np.bincount(edges).max() > 1: # repeated edges must be pushed in order
+            for edge, value in zip(edges, values):
+                MatrixGrapevine.push(buffer, count, next_slot, weights, np.array([edge]), np.array([value]))
+            return
+        buffer[edges, next_slot[edges]] = values
+        next_slot[edges] = (next_slot[edges] + 1) % buffer.shape[1]
+        count[edges] = np.minimum(count[edges] + 1, buffer.shape[1])
+        weights[edges] = buffer[edges].sum(axis=1) / count[edges] # unfilled slots are still 0
+
+    @staticmethod
+    def buffered(buffer: np.ndarray, count: np.ndarray, next_slot: np.ndarray, idx: int) -> List[float]:
+        '''
+            Buffered values of one edge, oldest first
+        '''
+        size = buffer.shape[1]
+        start = (next_slot[idx] - count[idx]) % size
+        return [float(buffer[idx, (start + i) % size]) for i in range(count[idx])]
@@ -1,16 +1,29 @@
+import os
 import re
+import json
+import time
 import faiss
-from NPC.utils import scale_to_range, normalize_vectors
+import numpy as np
+from NPC.MemoryStream import MemoryStream
+from NPC.MemoryIndex import MemoryIndex
+from NPC.SharedMemoryIndex import SharedMemoryIndex
+from NPC.utils import scale_array, normalize_vectors, map_concurrently
 from GPTEndpoint import GPTEndpoint
-from typing import List
+from EmbeddingCache import EmbeddingCache, LRUCache
+from typing import List, Dict, Tuple
 from Log import Log
 
-#TODO: investigate why using batch size > 1 causes odd results
-
 class Memory:
     
     IMPORTANCE_PROMPT = """On a scale of 1 to 10, where 1 is purely mundane (e.g., brushing teeth, making bed) and 10 is \
         extremely poignant (e.g., a break up, college acceptance, murder), rate the likely poignancy of the following memory."""
+
+    BATCH_IMPORTANCE_PROMPT = """On a scale of 1 to 10, where 1 is purely mundane (e.g., brushing teeth, making bed) and 10 is \
+        extremely poignant (e.g., a break up, college acceptance, murder), rate the likely poignancy of each of the following numbered memories. \
+        Respond with exactly one line per memory in the format <number>: <rating>."""
+
+    CONSOLIDATION_PROMPT = """Condense the following related memories into a single memory of one or two sentences, \
+        keeping the names, places and facts most likely to matter later."""
     
     def __init__(self, importance_threshold: float, 
                  embeddings_batch_size: int, 
@@ -19,11 +32,34 @@ class Memory:
                  relevance_weight: float,
                  importance_weight: float,
                  gpt_endpoint: GPTEndpoint, 
-                 log: Log) -> None:
+                 log: Log,
+                 candidate_pool_size: int = None,
+                 index: MemoryIndex = None,
+                 query_cache: LRUCache = None,
+                 owner: str = None,
+                 max_memories: int = None,
+                 max_bytes: int = None,
+                 consolidation_age: float = 86400,
+                 consolidation_importance: float = 5,
+                 consolidation_cluster_size: int = 8) -> None:
         """
             importance_threshold: memories with importance below this threshold will not be stored.
             embeddings_batch_size: number of memories in the record buffer (holds memories not yet processed into embeddings).
+                Buffered memories are committed before any read (query / recent), so batching never hides recent memories.
             embedding_length: dimensions parameter for embeddings.
+            candidate_pool_size: number of nearest neighbors scored by query (None: just k, -1: the entire memory stream).
+                A larger pool lets recency and importance surface memories outside the relevance top-k.
+            index: nearest-neighbor index for the stream (default: exact flat index; see MemoryIndex for HNSW / IVF and auto-upgrade,
+                or pass SharedMemoryIndex.view(name) to register every NPC's index in one SharedMemoryIndex).
+            query_cache: LRU of normalized query embeddings (default: 1024 entries for this Memory; pass one LRUCache to
+                several Memories to share it). Repeated queries then skip the embedding call entirely.
+            owner: name of the NPC this Memory belongs to, used to attribute its LLM usage (set by NPC if not given).
+            max_memories, max_bytes: caps on the memories kept (count, and bytes of text plus vectors; None: unbounded).
+                Past a cap, consolidate merges clusters of old, unimportant memories into summary memories until the
+                memory is back under 80% of its caps.
+            consolidation_age: only memories at least this old (in timestamp units) are consolidated.
+            consolidation_importance: only memories with importance below this are consolidated.
+            consolidation_cluster_size: average number of memories merged into one summary.
         """
         # params
         self.importance_threshold = importance_threshold # between [0, 10]
@@ -31,71 +67,330 @@ class Memory:
         self.embedding_dim = embedding_length
         self.LLM = gpt_endpoint
         self.log = log
+        self.owner = owner
         
         # structures
         self.text_record_buffer = [] 
         self.timestamp_record_buffer = []
         self.importance_record_buffer = []
-        self.memories_text = []
-        self.memories_timestamps = []
-        self.memories_importance = []
+        self.stream = MemoryStream() # committed memories (columnar)
+        self.importance_since_reflection = 0 # total importance of memories stored since the owner last reflected
         
         # faiss (mem query)
-        self.faiss_index = faiss.IndexFlatL2(self.embedding_dim) # normalize all incoming vectors = FAISS w/ cosine similarity 
+        self.index = index if index is not None else MemoryIndex(self.embedding_dim) # normalize all incoming vectors = FAISS w/ cosine similarity 
         self.recency_weight = recency_weight
         self.relevance_weight = relevance_weight
         self.importance_weight = importance_weight
+        self.candidate_pool_size = candidate_pool_size
+        self.query_cache = query_cache if query_cache is not None else LRUCache(1024)
+
+        # consolidation
+        self.max_memories = max_memories
+        self.max_bytes = max_bytes
+        self.consolidation_age = consolidation_age
+        self.consolidation_importance = consolidation_importance
+        self.consolidation_cluster_size = consolidation_cluster_size
     
     def record(self, memory_text: str, timestamp, force_commit: bool = False, memory_importance: int = 0) -> None:
         """Record a memory to the memory system (may not actually enter the stream until the record buffer is full).
         memory_importance: [0, 10] if != 0: force memory to have given importance, else ask LLM."""
-        if not memory_importance: memory_importance = self.importance(memory_text)
-        if memory_importance >= self.importance_threshold:
-            self.text_record_buffer.append(memory_text)
-            self.timestamp_record_buffer.append(timestamp)
-            self.importance_record_buffer.append(memory_importance)
-            if force_commit or len(self.text_record_buffer) == self.embeddings_batch_size:
-                # process embeddings in a batch
-                embeddings = self.LLM.embedding(self.text_record_buffer, dimensions=self.embedding_dim)
-                # faiss process
-                self.faiss_index.add(normalize_vectors(embeddings))
-                # add to memory stream
-                self.memories_text.extend(self.text_record_buffer)
-                self.memories_timestamps.extend(self.timestamp_record_buffer)
-                self.memories_importance.extend(self.importance_record_buffer)
-                # empty buffers
-                self.text_record_buffer = []
-                self.timestamp_record_buffer = []
-                self.importance_record_buffer = []
-                
+        self.record_many([memory_text], [timestamp], force_commit, [memory_importance])
+
+    def record_many(self, memory_texts: List[str], timestamps: List, force_commit: bool = False, memory_importances: List[int] = None) -> None:
+        """Record several memories at once: unrated memories are rated in a single LLM call, and survivors are embedded in one call.
+        memory_importances: per memory, [0, 10] if != 0: force memory to have given importance, else ask LLM."""
+        if memory_importances is None: memory_importances = [0] * len(memory_texts)
+        unrated = [i for i, memory_importance in enumerate(memory_importances) if not memory_importance]
+        if unrated:
+            memory_importances = list(memory_importances)
+            for i, memory_importance in zip(unrated, self.importance_many([memory_texts[i] for i in unrated])):
+                memory_importances[i] = memory_importance
+        for memory_text, timestamp, memory_importance in zip(memory_texts, timestamps, memory_importances):
+            if memory_importance >= self.importance_threshold:
+                self.text_record_buffer.append(memory_text)
+                self.timestamp_record_buffer.append(timestamp)
+                self.importance_record_buffer.append(memory_importance)
+                self.importance_since_reflection += memory_importance
+        if self.text_record_buffer and (force_commit or len(self.text_record_buffer) >= self.embeddings_batch_size):
+            self.commit()
+
+    def commit(self) -> None:
+        """Embed everything in the record buffer (one batched call) and move it into the memory stream."""
+        if not self.text_record_buffer:
+            return
+        # process embeddings in a batch
+        embeddings = self.LLM.embedding(self.text_record_buffer, dimensions=self.embedding_dim, caller=self.owner)
+        text_buffer, timestamp_buffer, importance_buffer = self.text_record_buffer, self.timestamp_record_buffer, self.importance_record_buffer
+        # empty buffers
+        self.text_record_buffer = []
+        self.timestamp_record_buffer = []
+        self.importance_record_buffer = []
+        self.record_embedded(text_buffer, timestamp_buffer, importance_buffer, embeddings)
+
+    def record_embedded(self, memory_texts: List[str], timestamps: List, memory_importances: List[int], embeddings: np.ndarray) -> None:
+        """Enter memories whose embeddings are already known straight into the memory stream (no LLM calls, no importance threshold)."""
+        self.commit() # keep ids in recording order
+        # faiss process
+        self.index.add(normalize_vectors(embeddings), np.arange(len(self.stream), len(self.stream) + len(embeddings)))
+        # add to memory stream
+        self.stream.extend(memory_texts, timestamps, memory_importances)
+
+    def recent(self, n: int) -> List[str]:
+        """Texts of the n most recent memories (oldest first)."""
+        self.commit()
+        ids = self.stream.alive_ids()
+        if n < len(ids):
+            ids = ids[np.argpartition(-self.stream.memories_timestamps[ids], n - 1)[:n]] if n > 0 else ids[:0]
+        return self.stream.texts(ids[np.lexsort((ids, self.stream.memories_timestamps[ids]))])
+
     def query(self, query_text: str, k: int, current_time) -> List[str]:
-        """Return the k memories most pertinent to the given query based on a weighted sum of cosine similarity and recency."""
-        
-        assert k <= self.faiss_index.ntotal, f'Memory size < {k}.'
-
-        query_embedding = self.LLM.embedding([query_text], dimensions=self.embedding_dim)[0]
-        distances, nearest_neighbor_indices = self.faiss_index.search(normalize_vectors([query_embedding])[0].reshape(1, -1), k)
-
-        time_deltas = [current_time - self.memories_timestamps[faiss_idx] for faiss_idx in nearest_neighbor_indices[0]]
-        importances = [self.memories_importance[faiss_idx] for faiss_idx in nearest_neighbor_indices[0]]
-        relevances = [1 / (dist + 0.0001) for dist in distances[0]]  # to prevent division by zero
-        scaled_time_deltas = scale_to_range(time_deltas)
-        scaled_relevances = scale_to_range(relevances)
-        scaled_importances = scale_to_range(importances)
-
-        scores = []
-        for time_delta, relevance, m_importance, idx in zip(scaled_time_deltas, scaled_relevances, scaled_importances, nearest_neighbor_indices[0]):
-            score = self.recency_weight * time_delta + self.relevance_weight * relevance + self.importance_weight * m_importance
-            scores.append((score, idx))
+        """Return the k memories most pertinent to the given query based on a weighted sum of cosine similarity, recency and importance."""
+        return self.stream.texts(self.query_ids(query_text, k, current_time))
+
+    def query_ids(self, query_text: str, k: int, current_time) -> np.ndarray:
+        """Like query, but return the ids (stream positions) of the memories."""
         
-        sorted_scores = sorted(scores, key=lambda x: x[0], reverse=True)[:k]
-        return [self.memories_text[idx] for _, idx in sorted_scores]
+        self.commit()
+        assert k <= self.index.ntotal, f'Memory size < {k}.'
+
+        query_embedding = self.embed_queries([query_text])
+        distances, nearest_neighbor_indices = self.index.search(query_embedding, self.pool_size(k))
+        return self.rank(distances[0], nearest_neighbor_indices[0], k, current_time)
+
+    @staticmethod
+    def query_many(requests: List[Tuple['Memory', str, int]], current_time) -> List[List[str]]:
+        """Answer (memory, query_text, k) requests from any number of Memories: query texts are embedded in one call per
+        (LLM, embedding size), and the requests on one SharedMemoryIndex are passed to its search_many together (one
+        batched search per owner)."""
+        return [memory.stream.texts(ids) for (memory, _, _), ids in zip(requests, Memory.query_many_ids(requests, current_time))]
+
+    @staticmethod
+    def query_many_ids(requests: List[Tuple['Memory', str, int]], current_time) -> List[np.ndarray]:
+        """Like query_many, but return the ids (stream positions) of the memories."""
+        if not requests:
+            return []
+        for memory, _, k in requests:
+            memory.commit()
+            assert k <= memory.index.ntotal, f'Memory size < {k}.'
+        query_embeddings = [None] * len(requests)
+        embedding_groups: Dict[Tuple[int, int], List[int]] = {}
+        for i, (memory, _, _) in enumerate(requests):
+            embedding_groups.setdefault((id(memory.LLM), memory.embedding_dim), []).append(i)
+        for group in embedding_groups.values():
+            for i, query_embedding in zip(group, requests[group[0]][0].embed_queries([requests[i][1] for i in group])):
+                query_embeddings[i] = query_embedding
+
+        results = [None] * len(requests)
+        shared_groups: Dict[int, List[int]] = {}
+        for i, (memory, _, _) in enumerate(requests):
+            if isinstance(memory.index, SharedMemoryIndex.View):
+                shared_groups.setdefault(id(memory.index.shared), []).append(i)
+            else:
+                distances, ids = memory.index.search(query_embeddings[i].reshape(1, -1), memory.pool_size(requests[i][2]))
+                results[i] = memory.rank(distances[0], ids[0], requests[i][2], current_time)
+        for group in shared_groups.values():
+            shared = requests[group[0]][0].index.shared
+            pool = max(requests[i][0].pool_size(requests[i][2]) for i in group)
+            distances, ids = shared.search_many([requests[i][0].index.owner for i in group], np.array([query_embeddings[i] for i in group]), pool)
+            for row, i in enumerate(group):
+                memory, _, k = requests[i]
+                pool_i = memory.pool_size(k)
+                results[i] = memory.rank(distances[row][:pool_i], ids[row][:pool_i], k, current_time)
+        return results
+
+    def embed_queries(self, query_texts: List[str]) -> np.ndarray:
+        """Normalized embeddings of the query texts; only texts missing from the query cache are sent (in one call)."""
+        keys = [(self.LLM.embedding_model, self.embedding_dim, EmbeddingCache.normalize_text(query_text)) for query_text in query_texts]
+        embeddings = [self.query_cache.get(key) for key in keys]
+        missing = list(dict.fromkeys(key for key, embedding in zip(keys, embeddings) if embedding is None))
+        if missing:
+            fresh = dict(zip(missing, normalize_vectors(self.LLM.embedding([key[2] for key in missing], dimensions=self.embedding_dim, caller=self.owner))))
+            for key, embedding in fresh.items(): self.query_cache.put(key, embedding)
+            embeddings = [fresh[key] if embedding is None else embedding for key, embedding in zip(keys, embeddings)]
+        return np.array(embeddings)
+
+    def rank(self, distances: np.ndarray, nearest_neighbor_indices: np.ndarray, k: int, current_time) -> np.ndarray:
+        """Score the candidate memories returned by the index and return the ids of the top k, best first."""
+        found = nearest_neighbor_indices >= 0 # approximate indexes may return fewer than requested
+        distances, nearest_neighbor_indices = distances[found], nearest_neighbor_indices[found]
+        k = min(k, len(nearest_neighbor_indices))
+
+        time_deltas = current_time - self.stream.memories_timestamps[nearest_neighbor_indices]
+        importances = self.stream.memories_importance[nearest_neighbor_indices].astype(np.float64)
+        relevances = 1 / (distances + 0.0001) # to prevent division by zero
+        # recency: the newest candidate scores 1, the oldest 0
+        scores = self.recency_weight * scale_array(-time_deltas) + \
+                 self.relevance_weight * scale_array(relevances) + \
+                 self.importance_weight * scale_array(importances)
+
+        top_k = np.argpartition(-scores, k - 1)[:k] if k < len(scores) else np.arange(len(scores))
+        top_k = top_k[np.argsort(-scores[top_k], kind='stable')]
+        return nearest_neighbor_indices[top_k]
+
+    @property
+    def memories_text(self) -> MemoryStream:
+        """Texts of committed memories (supports len, indexing and slicing like a list)."""
+        return self.stream
+
+    @property
+    def memories_timestamps(self) -> np.ndarray:
+        return self.stream.memories_timestamps
+
+    @property
+    def memories_importance(self) -> np.ndarray:
+        return self.stream.memories_importance
+
+    def save(self, folder: str) -> None:
+        """Save the memory stream, FAISS index, record buffer and parameters to a folder."""
+        self.stream.save(folder)
+        self.index.save(os.path.join(folder, 'index.faiss'))
+        with open(os.path.join(folder, 'memory.json'), 'w') as file:
+            json.dump(self.params(), file)
+
+    def params(self) -> Dict:
+        """Constructor parameters plus the record buffer, as saved in memory.json."""
+        return {'importance_threshold': self.importance_threshold, 'embeddings_batch_size': self.embeddings_batch_size,
+                'embedding_length': self.embedding_dim, 'recency_weight': self.recency_weight,
+                'relevance_weight': self.relevance_weight, 'importance_weight': self.importance_weight,
+                'candidate_pool_size': self.candidate_pool_size, 'owner': self.owner, 'max_memories': self.max_memories,
+                'max_bytes': self.max_bytes, 'consolidation_age': self.consolidation_age,
+                'consolidation_importance': self.consolidation_importance, 'consolidation_cluster_size': self.consolidation_cluster_size,
+                'index': self.index.params(),
+                'record_buffer': [self.text_record_buffer, self.timestamp_record_buffer, self.importance_record_buffer]}
+
+    @classmethod
+    def load(cls, folder: str, gpt_endpoint: GPTEndpoint, log: Log, mmap: bool = True, shared_indexes: Dict[int, SharedMemoryIndex] = None) -> 'Memory':
+        """Load a Memory written by save (no LLM or embedding calls). With mmap, the stream columns are memory-mapped.
+        shared_indexes: embedding size -> SharedMemoryIndex that a Memory saved from a shared index rejoins (see rejoin_shared_index)."""
+        with open(os.path.join(folder, 'memory.json'), 'r') as file:
+            params = json.load(file)
+        text_buffer, timestamp_buffer, importance_buffer = params.pop('record_buffer')
+        index_params = params.pop('index')
+        index = MemoryIndex.load(os.path.join(folder, 'index.faiss'), index_params, mmap=mmap and not index_params.get('shared'))
+        index = Memory.rejoin_shared_index(index, index_params, shared_indexes)
+        memory = cls(gpt_endpoint=gpt_endpoint, log=log, index=index, **params)
+        memory.text_record_buffer, memory.timestamp_record_buffer, memory.importance_record_buffer = text_buffer, timestamp_buffer, importance_buffer
+        memory.stream = MemoryStream.load(folder, mmap=mmap)
+        return memory
+
+    def snapshot(self) -> Dict[str, np.ndarray]:
+        """Everything save writes, as named arrays: the stream columns, the serialized index and memory.json (UTF-8)."""
+        params = dict(self.params(), importance_since_reflection=self.importance_since_reflection)
+        return dict(self.stream.arrays(), index=self.index.serialize(),
+                    params=np.frombuffer(json.dumps(params).encode('utf-8'), dtype=np.uint8))
+
+    @classmethod
+    def restore(cls, arrays: Dict[str, np.ndarray], gpt_endpoint: GPTEndpoint, log: Log, shared_indexes: Dict[int, SharedMemoryIndex] = None) -> 'Memory':
+        """Rebuild a Memory from snapshot arrays (no LLM or embedding calls). shared_indexes: as in load."""
+        params = json.loads(arrays['params'].tobytes().decode('utf-8'))
+        text_buffer, timestamp_buffer, importance_buffer = params.pop('record_buffer')
+        importance_since_reflection = params.pop('importance_since_reflection')
+        index_params = params.pop('index')
+        index = Memory.rejoin_shared_index(MemoryIndex.deserialize(arrays['index'], index_params), index_params, shared_indexes)
+        memory = cls(gpt_endpoint=gpt_endpoint, log=log, index=index, **params)
+        memory.text_record_buffer, memory.timestamp_record_buffer, memory.importance_record_buffer = text_buffer, timestamp_buffer, importance_buffer
+        memory.importance_since_reflection = importance_since_reflection
+        memory.stream = MemoryStream.from_arrays(arrays)
+        return memory
+
+    @staticmethod
+    def rejoin_shared_index(index: MemoryIndex, index_params: Dict, shared_indexes: Dict[int, SharedMemoryIndex] = None):
+        """A SharedMemoryIndex.View is saved as a standalone flat index; move its vectors back into the SharedMemoryIndex of its
+        embedding size in shared_indexes (created there if missing; a new one if shared_indexes is None) and return the view.
+        Other indexes are returned as they are."""
+        if not index_params.pop('shared', False):
+            return index
+        shared_indexes = {} if shared_indexes is None else shared_indexes
+        view = shared_indexes.setdefault(index.dim, SharedMemoryIndex(index.dim)).view(index_params.pop('owner'))
+        ids, vectors = index.vectors()
+        if len(ids): view.add(vectors, ids)
+        return view
+
+    @property
+    def nbytes(self) -> int:
+        """Bytes held for the memories: stream columns and text plus index vectors."""
+        return self.stream.nbytes + self.index.ntotal * self.embedding_dim * 4
+
+    def over_caps(self, fraction: float = 1) -> bool:
+        return (self.max_memories is not None and self.index.ntotal > fraction * self.max_memories) or \
+               (self.max_bytes is not None and self.nbytes > fraction * self.max_bytes)
+
+    def consolidate(self, current_time) -> Dict:
+        """If the memory is over one of its caps, cluster old, unimportant memories (k-means over their embeddings), replace
+        each cluster by one summary memory (one LLM call per cluster, run concurrently), remove the originals from the
+        index and the stream, and compact the stream. Returns a report (memories and bytes before and after, and the latency of a batch of index
+        searches before and after), or None if nothing was done."""
+        self.commit()
+        if not self.over_caps():
+            return None
+        ids = self.stream.alive_ids()
+        timestamps, importances = self.stream.memories_timestamps[ids], self.stream.memories_importance[ids]
+        candidates = ids[(timestamps <= current_time - self.consolidation_age) & (importances < self.consolidation_importance)]
+        candidates = candidates[np.argsort(self.stream.memories_timestamps[candidates], kind='stable')] # oldest first
+        # memories to remove to get back under 80% of the caps (each cluster of c memories frees c - 1)
+        excess = 0
+        if self.max_memories is not None: excess = max(excess, self.index.ntotal - int(0.8 * self.max_memories))
+        if self.max_bytes is not None: excess = max(excess, int(np.ceil((self.nbytes - 0.8 * self.max_bytes) / (self.nbytes / len(ids)))))
+        cluster_size = max(2, self.consolidation_cluster_size)
+        candidates = candidates[:int(np.ceil(excess * cluster_size / (cluster_size - 1)))]
+        if len(candidates) < 2:
+            self.log.log(f'{self.owner}\'s memory is over its caps but has no old, unimportant memories to consolidate.')
+            return None
+
+        stored_ids, stored_vectors = self.index.vectors()
+        rows = {int(idx): row for row, idx in enumerate(stored_ids)}
+        vectors = np.ascontiguousarray(stored_vectors[[rows[int(idx)] for idx in candidates]], dtype=np.float32)
+        n_clusters = max(1, len(candidates) // cluster_size)
+        kmeans = faiss.Kmeans(self.embedding_dim, n_clusters, niter=20, seed=len(self.stream), spherical=True, min_points_per_centroid=1)
+        kmeans.train(vectors)
+        assignments = kmeans.index.search(vectors, 1)[1][:, 0]
+        clusters = [candidates[assignments == cluster] for cluster in range(n_clusters)]
+        clusters = [cluster[np.argsort(self.stream.memories_timestamps[cluster], kind='stable')] for cluster in clusters if len(cluster) > 1]
+        if not clusters:
+            return None
+
+        probes = normalize_vectors(stored_vectors[np.linspace(0, len(stored_vectors) - 1, 32).astype(np.int64)])
+        report = {'memories_before': self.index.ntotal, 'bytes_before': self.nbytes, 'query_ms_before': self.search_latency(probes)}
+        summaries = map_concurrently(lambda cluster: self.LLM.complete([{'role': 'system', 'content': self.CONSOLIDATION_PROMPT},
+                                                                        {'role': 'user', 'content': 'Memories:\n' + '\n'.join(self.stream.texts(cluster))}],
+                                                                       phase='consolidate', caller=self.owner), clusters)
+        embeddings = self.LLM.embedding(summaries, dimensions=self.embedding_dim, phase='consolidate', caller=self.owner)
+        removed = np.concatenate(clusters)
+        self.index.remove(removed)
+        self.stream.remove(removed)
+        self.record_embedded(summaries, [float(self.stream.memories_timestamps[cluster].max()) for cluster in clusters],
+                             [float(self.stream.memories_importance[cluster].max()) for cluster in clusters], embeddings)
+        self.compact()
+        report.update({'clusters': len(clusters), 'removed': len(removed), 'memories_after': self.index.ntotal,
+                       'bytes_after': self.nbytes, 'query_ms_after': self.search_latency(probes)})
+        self.log.log(f'{self.owner} consolidated {len(removed)} memories into {len(clusters)}: {report}')
+        return report
+
+    def compact(self) -> None:
+        """Drop removed memories from the stream for good and renumber the index to match (ids are stream positions)."""
+        self.index.renumber(self.stream.compact())
+
+    def search_latency(self, probes: np.ndarray, k: int = 5) -> float:
+        """Milliseconds to search the index for a batch of probe vectors, one query at a time."""
+        k = min(k, self.index.ntotal)
+        start = time.perf_counter()
+        for probe in probes:
+            self.index.search(probe.reshape(1, -1), k)
+        return (time.perf_counter() - start) * 1000
+
+    def pool_size(self, k: int) -> int:
+        """Number of nearest neighbors to score for a top-k query."""
+        if self.candidate_pool_size is None:
+            return k
+        if self.candidate_pool_size < 0:
+            return self.index.ntotal
+        return min(max(k, self.candidate_pool_size), self.index.ntotal)
 
     def importance(self, memory_text: str) -> bool:
         """Ask the LLM for an importance score regarding the memory."""
         msg_stream = [{'role':'system', 'content':self.IMPORTANCE_PROMPT}, 
                       {"role": "user", "content": f'Memory: {memory_text} \n Rating: <fill in>'}]
-        response = self.LLM.complete(msg_stream)
+        response = self.LLM.complete(msg_stream, phase='importance', caller=self.owner)
         match = re.search(r'\d+', response)
         importance = 10 # default value in case of exceptions
         try:
@@ -109,4 +404,38 @@ class Memory:
             print(f"Unexpected error while determining importance: {e}")
         self.log.log(f'Memory: {memory_text}, Importance: {importance}.')
         return importance
-    
\ No newline at end of file
+    
+    def importance_many(self, memory_texts: List[str]) -> List[int]:
+        """Ask the LLM for the importance of several memories in a single call. Items missing from the reply are rated individually."""
+        if len(memory_texts) == 1:
+            return [self.importance(memory_texts[0])]
+        numbered = '\n'.join(f'{i + 1}. {" ".join(memory_text.split())}' for i, memory_text in enumerate(memory_texts))
+        msg_stream = [{'role':'system', 'content':self.BATCH_IMPORTANCE_PROMPT},
+                      {"role": "user", "content": f'Memories:\n{numbered}\nRatings: <fill in>'}]
+        ratings = self.parse_ratings(self.LLM.complete(msg_stream, phase='importance', caller=self.owner), len(memory_texts))
+        importances = []
+        for i, memory_text in enumerate(memory_texts):
+            if i in ratings:
+                importances.append(ratings[i])
+                self.log.log(f'Memory: {memory_text}, Importance: {ratings[i]}.')
+            else:
+                self.log.log(f'Batched importance missing for memory {memory_text}.')
+                importances.append(self.importance(memory_text))
+        return importances
+
+    @staticmethod
+    def parse_ratings(response: str, n: int) -> Dict[int, int]:
+        """Parse '<number>: <rating>' lines into {index: rating}; the rating is the last number on the line (not counting
+        the 10 of '8/10'), so echoed memory text is skipped. If no line is numbered but there are exactly n numbers, they
+        are taken in order. Ratings are clipped to [1, 10]."""
+        ratings = {}
+        for line in response.split('\n'):
+            match = re.match(r'\D*?(\d+)\s*[:.)=-](.*)', line)
+            numbers = re.findall(r'(?<![/\d])\d+', match.group(2)) if match else []
+            if numbers and 1 <= int(match.group(1)) <= n:
+                ratings[int(match.group(1)) - 1] = min(10, max(1, int(numbers[-1])))
+        if not ratings:
+            numbers = re.findall(r'\d+', response)
+            if len(numbers) == n:
+                ratings = {i: min(10, max(1, int(number))) for i, number in enumerate(numbers)}
+        return ratings
@@ -0,0 +1,140 @@
+import os
+import faiss
+import numpy as np
+from typing import Dict, Tuple
+
+class MemoryIndex:
+    """
+        Nearest-neighbor index over normalized memory embeddings, addressed by memory id (the memory's position in the stream).
+        kind selects the FAISS structure:
+            'flat': exact inner-product scan (cost grows linearly with the stream).
+            'hnsw': HNSW graph, approximate; ef_search trades recall for latency.
+            'ivf': inverted file over k-means cells, approximate; nprobe trades recall for latency.
+        If upgrade_kind is given, the index is rebuilt as upgrade_kind (keeping every id) once ntotal reaches upgrade_threshold.
+
+        search returns squared L2 distances (2 - 2 * cosine similarity), matching the IndexFlatL2 this replaces.
+    """
+
+    KINDS = ('flat', 'hnsw', 'ivf')
+
+    def __init__(self, dim: int, kind: str = 'flat', upgrade_kind: str = None, upgrade_threshold: int = 50000,
+                 hnsw_m: int = 32, ef_construction: int = 80, ef_search: int = 64, nlist: int = None, nprobe: int = 16) -> None:
+        assert kind in MemoryIndex.KINDS and (upgrade_kind is None or upgrade_kind in MemoryIndex.KINDS), 'Unknown index kind.'
+        self.dim = dim
+        self.upgrade_kind = upgrade_kind
+        self.upgrade_threshold = upgrade_threshold
+        self.hnsw_m = hnsw_m
+        self.ef_construction = ef_construction
+        self.ef_search = ef_search
+        self.nlist = nlist # None: 4 * sqrt(n) at build time
+        self.nprobe = nprobe
+        self.kind = kind
+        self.index = self.build(kind, np.empty((0, dim), dtype=np.float32))
+
+    def build(self, kind: str, training_vectors: np.ndarray) -> faiss.IndexIDMap2:
+        if kind == 'hnsw':
+            inner = faiss.IndexHNSWFlat(self.dim, self.hnsw_m, faiss.METRIC_INNER_PRODUCT)
+            inner.hnsw.efConstruction = self.ef_construction
+        elif kind == 'ivf':
+            assert len(training_vectors) > 0, 'An IVF index must be trained; start flat and upgrade to ivf.'
+            nlist = self.nlist or max(1, int(4 * np.sqrt(len(training_vectors))))
+            nlist = min(nlist, len(training_vectors))
+            inner = faiss.IndexIVFFlat(faiss.IndexFlatIP(self.dim), self.dim, nlist, faiss.METRIC_INNER_PRODUCT)
+            inner.train(training_vectors)
+            inner.make_direct_map() # needed to reconstruct vectors on migration
+        else:
+            inner = faiss.IndexFlatIP(self.dim)
+        index = faiss.IndexIDMap2(inner)
+        self.configure(index)
+        return index
+
+    def configure(self, index: faiss.IndexIDMap2) -> None:
+        """Apply search-time parameters to the wrapped index."""
+        inner = faiss.downcast_index(index.index)
+        if isinstance(inner, faiss.IndexHNSW):
+            inner.hnsw.efSearch = self.ef_search
+        elif isinstance(inner, faiss.IndexIVF):
+            inner.nprobe = self.nprobe
+
+    @property
+    def ntotal(self) -> int:
+        return self.index.ntotal
+
+    def add(self, vectors: np.ndarray, ids: np.ndarray) -> None:
+        """Add normalized vectors under the given memory ids."""
+        self.index.add_with_ids(np.ascontiguousarray(vectors, dtype=np.float32), np.asarray(ids, dtype=np.int64))
+        if self.upgrade_kind and self.kind != self.upgrade_kind and self.ntotal >= self.upgrade_threshold:
+            self.migrate(self.upgrade_kind)
+
+    def remove(self, ids: np.ndarray) -> None:
+        """Remove memories by id. The flat index removes in place; HNSW and IVF are rebuilt from the remaining vectors
+        (or emptied, keeping an IVF index's trained cells, when nothing remains)."""
+        ids = np.asarray(ids, dtype=np.int64)
+        if self.kind == 'flat':
+            self.index.remove_ids(ids)
+            return
+        stored_ids, vectors = self.vectors()
+        keep = ~np.isin(stored_ids, ids)
+        if not keep.any():
+            self.index.reset()
+            return
+        index = self.build(self.kind, vectors[keep])
+        index.add_with_ids(vectors[keep], stored_ids[keep])
+        self.index = index
+
+    def renumber(self, new_ids: np.ndarray) -> None:
+        """Change every memory id in place: id i becomes new_ids[i] (no vector is moved or re-added)."""
+        ids = faiss.vector_to_array(self.index.id_map)
+        faiss.copy_array_to_vector(np.asarray(new_ids, dtype=np.int64)[ids], self.index.id_map)
+        self.index.construct_rev_map()
+
+    def search(self, queries: np.ndarray, k: int) -> Tuple[np.ndarray, np.ndarray]:
+        """Return (squared L2 distances, ids) of the k nearest memories per query. Missing results have id -1."""
+        inner = faiss.downcast_index(self.index.index)
+        if isinstance(inner, faiss.IndexHNSW):
+            inner.hnsw.efSearch = max(self.ef_search, k)
+        similarities, ids = self.index.search(np.ascontiguousarray(queries, dtype=np.float32), k)
+        distances = np.full(similarities.shape, np.inf, dtype=np.float32)
+        distances[ids >= 0] = np.maximum(2 - 2 * similarities[ids >= 0], 0)
+        return distances, ids
+
+    def vectors(self) -> Tuple[np.ndarray, np.ndarray]:
+        """Return (ids, vectors) of everything in the index."""
+        ids = faiss.vector_to_array(self.index.id_map).astype(np.int64)
+        return ids, self.index.index.reconstruct_n(0, self.ntotal)
+
+    def migrate(self, kind: str) -> None:
+        """Rebuild the index as another kind, keeping every id."""
+        ids, vectors = self.vectors()
+        index = self.build(kind, vectors)
+        if len(ids): index.add_with_ids(vectors, ids)
+        self.index, self.kind = index, kind
+
+    def params(self) -> Dict:
+        return {'dim': self.dim, 'kind': self.kind, 'upgrade_kind': self.upgrade_kind, 'upgrade_threshold': self.upgrade_threshold,
+                'hnsw_m': self.hnsw_m, 'ef_construction': self.ef_construction, 'ef_search': self.ef_search,
+                'nlist': self.nlist, 'nprobe': self.nprobe}
+
+    def save(self, path: str) -> None:
+        faiss.write_index(self.index, path)
+
+    def serialize(self) -> np.ndarray:
+        """The index as a uint8 array (for snapshots)."""
+        return faiss.serialize_index(self.index)
+
+    @classmethod
+    def deserialize(cls, data: np.ndarray, params: Dict) -> 'MemoryIndex':
+        memory_index = cls.__new__(cls)
+        memory_index.__dict__.update(params)
+        memory_index.index = faiss.deserialize_index(np.ascontiguousarray(data, dtype=np.uint8))
+        memory_index.configure(memory_index.index)
+        return memory_index
+
+    @classmethod
+    def load(cls, path: str, params: Dict, mmap: bool = True) -> 'MemoryIndex':
+        memory_index = cls.__new__(cls)
+        memory_index.__dict__.update(params)
+        mmap = mmap and params['kind'] != 'ivf' # memory-mapped inverted lists are read-only
+        memory_index.index = faiss.read_index(path, faiss.IO_FLAG_MMAP if mmap and os.path.getsize(path) > 0 else 0)
+        memory_index.configure(memory_index.index)
+        return memory_index
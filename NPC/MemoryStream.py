@@ -0,0 +1,147 @@
+import os
+import numpy as np
+from typing import Dict, List, Sequence, Union
+
+class MemoryStream:
+    """
+        Columnar store for the memory stream: memory i has timestamp timestamps[i], importance importance[i] and text
+        text_blob[offsets[i]:offsets[i+1]] (UTF-8). Columns start small and are grown by doubling, so per-memory overhead is
+        a few bytes plus the text itself, and saved streams are memory-mapped back in instead of being parsed.
+
+        Indexing behaves like the list of texts it replaces: stream[i] -> str, stream[-n:] -> List[str].
+        Removed memories (see remove) keep their position, so ids stay stable, until compact drops them and renumbers the
+        rest; alive marks the memories still in use.
+    """
+
+    def __init__(self, capacity: int = 16) -> None:
+        self.size = 0
+        self.timestamps = np.empty(capacity, dtype=np.float64)
+        self.importance = np.empty(capacity, dtype=np.float32)
+        self.offsets = np.zeros(capacity + 1, dtype=np.int64)
+        self.text_blob = np.empty(capacity * 64, dtype=np.uint8)
+        self.alive = np.ones(capacity, dtype=bool)
+
+    def extend(self, texts: List[str], timestamps: List[float], importances: List[float]) -> None:
+        """Append memories to the end of the stream."""
+        encoded = [text.encode('utf-8') for text in texts]
+        n, n_bytes = len(encoded), sum(len(text) for text in encoded)
+        end = self.offsets[self.size]
+        if self.size + n > len(self.timestamps):
+            capacity = max(2 * len(self.timestamps), self.size + n)
+            self.timestamps = self.grow(self.timestamps, capacity)
+            self.importance = self.grow(self.importance, capacity)
+            self.offsets = self.grow(self.offsets, capacity + 1)
+            self.alive = self.grow(self.alive, capacity)
+        if end + n_bytes > len(self.text_blob):
+            self.text_blob = self.grow(self.text_blob, max(2 * len(self.text_blob), end + n_bytes))
+        self.timestamps[self.size:self.size + n] = timestamps
+        self.importance[self.size:self.size + n] = importances
+        self.offsets[self.size + 1:self.size + n + 1] = end + np.cumsum([len(text) for text in encoded])
+        self.text_blob[end:end + n_bytes] = np.frombuffer(b''.join(encoded), dtype=np.uint8)
+        self.alive[self.size:self.size + n] = True
+        self.size += n
+
+    def remove(self, indices: Sequence[int]) -> None:
+        """Mark memories as removed (their rows stay in place so later ids do not shift)."""
+        if not self.alive.flags.writeable: self.alive = np.array(self.alive)
+        self.alive[np.asarray(indices, dtype=np.int64)] = False
+
+    def alive_ids(self) -> np.ndarray:
+        return np.flatnonzero(self.alive[:self.size])
+
+    def compact(self) -> np.ndarray:
+        """Drop the removed memories' rows and text, renumbering the rest in order (into fresh in-memory columns).
+        Returns new_ids: memory i is now memory new_ids[i] (-1 if it was removed)."""
+        keep = self.alive_ids()
+        new_ids = np.full(self.size, -1, dtype=np.int64)
+        new_ids[keep] = np.arange(len(keep))
+        starts, lengths = self.offsets[keep], self.offsets[keep + 1] - self.offsets[keep]
+        offsets = np.zeros(len(keep) + 1, dtype=np.int64)
+        np.cumsum(lengths, out=offsets[1:])
+        self.text_blob = self.text_blob[np.repeat(starts - offsets[:-1], lengths) + np.arange(offsets[-1])]
+        self.timestamps, self.importance, self.offsets = self.timestamps[keep], self.importance[keep], offsets
+        self.alive = np.ones(len(keep), dtype=bool)
+        self.size = len(keep)
+        return new_ids
+
+    @staticmethod
+    def grow(column: np.ndarray, capacity: int) -> np.ndarray:
+        """Copy a column into a larger in-memory array (also detaches memory-mapped columns from their file)."""
+        grown = np.empty(capacity, dtype=column.dtype)
+        grown[:len(column)] = column
+        return grown
+
+    def text(self, idx: int) -> str:
+        return self.text_blob[self.offsets[idx]:self.offsets[idx + 1]].tobytes().decode('utf-8')
+
+    def texts(self, indices: Sequence[int]) -> List[str]:
+        return [self.text(idx) for idx in indices]
+
+    @property
+    def memories_timestamps(self) -> np.ndarray:
+        return self.timestamps[:self.size]
+
+    @property
+    def memories_importance(self) -> np.ndarray:
+        return self.importance[:self.size]
+
+    @property
+    def nbytes(self) -> int:
+        """Bytes used by the stream's columns."""
+        return int(self.offsets[self.size]) + self.size * (self.timestamps.itemsize + self.importance.itemsize + self.offsets.itemsize + self.alive.itemsize)
+
+
+    def __len__(self) -> int:
+        return self.size
+
+    def __getitem__(self, idx: Union[int, slice]) -> Union[str, List[str]]:
+        if isinstance(idx, slice):
+            return self.texts(range(*idx.indices(self.size)))
+        if idx < 0: idx += self.size
+        if not 0 <= idx < self.size:
+            raise IndexError('memory stream index out of range')
+        return self.text(idx)
+
+    def __iter__(self):
+        return (self.text(idx) for idx in range(self.size))
+
+    def save(self, folder: str) -> None:
+        os.makedirs(folder, exist_ok=True)
+        np.save(os.path.join(folder, 'timestamps.npy'), self.memories_timestamps)
+        np.save(os.path.join(folder, 'importance.npy'), self.memories_importance)
+        np.save(os.path.join(folder, 'offsets.npy'), self.offsets[:self.size + 1])
+        self.text_blob[:self.offsets[self.size]].tofile(os.path.join(folder, 'text.bin'))
+        np.save(os.path.join(folder, 'alive.npy'), self.alive[:self.size])
+
+    def arrays(self) -> Dict[str, np.ndarray]:
+        """The stream's columns, trimmed to its size (views, not copies)."""
+        return {'timestamps': self.memories_timestamps, 'importance': self.memories_importance,
+                'offsets': self.offsets[:self.size + 1], 'text': self.text_blob[:self.offsets[self.size]], 'alive': self.alive[:self.size]}
+
+    @classmethod
+    def from_arrays(cls, arrays: Dict[str, np.ndarray]) -> 'MemoryStream':
+        """Rebuild a stream from the columns returned by arrays."""
+        stream = cls.__new__(cls)
+        stream.timestamps, stream.importance = arrays['timestamps'], arrays['importance']
+        stream.offsets, stream.text_blob = arrays['offsets'], arrays['text']
+        stream.size = len(stream.timestamps)
+        stream.alive = arrays['alive'] if 'alive' in arrays else np.ones(stream.size, dtype=bool)
+        return stream
+
+    @classmethod
+    def load(cls, folder: str, mmap: bool = True) -> 'MemoryStream':
+        """Load a saved stream. With mmap, columns are mapped read-only and only copied into memory on the next append."""
+        mmap_mode = 'r' if mmap else None
+        stream = cls.__new__(cls)
+        stream.timestamps = np.load(os.path.join(folder, 'timestamps.npy'), mmap_mode=mmap_mode)
+        stream.importance = np.load(os.path.join(folder, 'importance.npy'), mmap_mode=mmap_mode)
+        stream.offsets = np.load(os.path.join(folder, 'offsets.npy'), mmap_mode=mmap_mode)
+        stream.size = len(stream.timestamps)
+        text_path = os.path.join(folder, 'text.bin')
+        if mmap and os.path.getsize(text_path) > 0:
+            stream.text_blob = np.memmap(text_path, dtype=np.uint8, mode='r')
+        else:
+            stream.text_blob = np.fromfile(text_path, dtype=np.uint8)
+        alive_path = os.path.join(folder, 'alive.npy') # absent in streams saved before removal existed
+        stream.alive = np.load(alive_path, mmap_mode=mmap_mode) if os.path.exists(alive_path) else np.ones(stream.size, dtype=bool)
+        return stream
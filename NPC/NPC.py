@@ -1,9 +1,15 @@
+import os
+import json
 import random
+import hashlib
+import numpy as np
 from NPC.Memory import Memory
 from NPC.Prompts import Prompts
 from GPTEndpoint import GPTEndpoint
 from Log import Log
-from typing import List
+from Tokens import count_tokens
+from NPC.utils import map_concurrently
+from typing import Dict, Generator, List, Set
 
 class NPC:
 
@@ -11,82 +17,270 @@ class NPC:
 
     """A generative NPC. Architectural ideas inspired from https://doi.org/10.1145/3586183.3606763."""
 
+    class DialogueContext:
+        '''
+            Per-conversation cache of the memories retrieved for the dialogue context and the context summary built from them,
+            plus the running summary of the dialogue turns that no longer fit the prompt budget
+        '''
+
+        def __init__(self, memory_ids: Set[int] = None, context: str = None) -> None:
+            self.memory_ids = memory_ids if memory_ids is not None else set()
+            self.context = context
+            self.history_summary = ''
+            self.summarized_turns = 0 # dialogue_history[:summarized_turns] is covered by history_summary
+
+        def overlap(self, memory_ids: Set[int]) -> float:
+            """Jaccard similarity between the cached and the newly retrieved memories."""
+            union = self.memory_ids | memory_ids
+            return len(self.memory_ids & memory_ids) / len(union) if union else 1
+
     def __init__(
             self, name: str, pronoun: str, age: int, 
             traits: List[str], initial_description: str, statuses: List[str],
-            time, reflection_buffer_length: int, memory: Memory, LLM: GPTEndpoint, log: Log
+            time, reflection_buffer_length: int, memory: Memory, LLM: GPTEndpoint, log: Log,
+            context_reuse_threshold: float = 0.5, reflection_importance_threshold: float = None,
+            summary_cache_folder: str = None, summary_refresh_memories: int = 50, record_seed: bool = True
     ) -> None:
+        """
+            context_reuse_threshold: a conversation's dialogue context summary is reused while the memories retrieved for it
+                overlap the cached ones by at least this much (Jaccard similarity); 1 regenerates on any change.
+            reflection_importance_threshold: maybe_reflect only reflects once the importance of the memories stored since the
+                last reflection adds up to this much (None: always reflect).
+            summary_cache_folder: if given, character summaries are cached on disk there, keyed by a hash of the NPC's seed, traits
+                and the memories the summary is built from (so a restarted world reuses them).
+            summary_refresh_memories: the character summary is generated lazily on first use, and regenerated once this many
+                memories have been stored since.
+            record_seed: False if the seed statements are already in memory (e.g. a restored snapshot or a World loaded in bulk).
+        """
         # characteristics
         self.name = name
         self.traits = traits
         self.statuses = statuses
         self.pronoun = pronoun
         self.age = age
+        self.is_alive = True # see Grapevine.kill
 
         # external
         self.LLM = LLM
         self.log = log
         self.memory = memory
+        if self.memory.owner is None: self.memory.owner = name
         self.prompt = Prompts(self)
 
         # setup
         self.seed = initial_description # ; separated statements (entered into memory)
-        for mem in self.seed.split(';'): self.memory.record(mem, time, force_commit=True, memory_importance=10)
-        self.synthesize_summary(time)
+        if record_seed:
+            statements = self.seed_statements()
+            self.memory.record_many(statements, [time] * len(statements), force_commit=True, memory_importances=[10] * len(statements))
+            self.memory.importance_since_reflection = 0 # the seed does not count towards reflection
+        self.summary_cache_folder = summary_cache_folder
+        self.summary_refresh_memories = summary_refresh_memories
+        self.cached_character_summary = None # built lazily (see character_summary)
+        self.summary_memory_count = 0 # memories recorded when the summary was built
 
         # structures
         self.reflection_buffer_length = reflection_buffer_length
+        self.reflection_importance_threshold = reflection_importance_threshold
+        self.context_reuse_threshold = context_reuse_threshold
+        self.dialogue_contexts: Dict[str, NPC.DialogueContext] = {} # receiver name -> context of the ongoing conversation
+        self.prompt_tokens_saved = 0 # dialogue history tokens kept out of prompts by compaction
+
+    def seed_statements(self) -> List[str]:
+        return [statement.strip() for statement in self.seed.split(';') if statement.strip()]
+
+    @property
+    def character_summary(self) -> str:
+        """Concise agent summary, synthesized on first use and again once the memory stream has grown by summary_refresh_memories."""
+        if self.cached_character_summary is None or self.memory_count() - self.summary_memory_count >= self.summary_refresh_memories:
+            self.memory.commit()
+            self.synthesize_summary(float(self.memory.memories_timestamps.max()))
+        return self.cached_character_summary
+
+    @character_summary.setter
+    def character_summary(self, summary: str) -> None:
+        self.cached_character_summary = summary
+        self.summary_memory_count = self.memory_count()
+
+    def memory_count(self) -> int:
+        return len(self.memory.stream) + len(self.memory.text_record_buffer)
 
     def synthesize_summary(self, time) -> None:
-        """Dynamically generate concise agent summary."""
+        """Dynamically generate concise agent summary (read from the summary cache if the same statements were summarized before)."""
+
+        core_statements = self.memory.query(f'{self.name}\'s core characteristics.', 3, time) # statements relevant to core characteristics
+        progress_statements = self.memory.query(f'{self.name}\'s recent life progress.', 3, time) # statements relevant to life progress
+        cache_path = self.summary_cache_path(core_statements, progress_statements)
+        if cache_path and os.path.exists(cache_path):
+            with open(cache_path, 'r') as file:
+                self.character_summary = json.load(file)['character_summary']
+            self.log.log(f'{self.name} loaded a cached character summary: \n {self.character_summary}')
+            return
 
         # core nature
-        statements = self.memory.query(f'{self.name}\'s core characteristics.', 3, time) # statements relevant to core characteristics
-        msg_stream = [{"role": "user", "content": self.prompt.core_characteristics(statements)}]
-        core_nature = self.LLM.complete(msg_stream)
+        msg_stream = [{"role": "user", "content": self.prompt.core_characteristics(core_statements)}]
+        core_nature = self.LLM.complete(msg_stream, phase='summary', caller=self.name)
         
         # life progress
-        statements = self.memory.query(f'{self.name}\'s recent life progress.', 3, time) # statements relevant to life progress
-        msg_stream = [{"role": "user", "content": self.prompt.life_progress(statements)}]
-        life_progress = self.LLM.complete(msg_stream)
+        msg_stream = [{"role": "user", "content": self.prompt.life_progress(progress_statements)}]
+        life_progress = self.LLM.complete(msg_stream, phase='summary', caller=self.name)
 
         self.character_summary = self.prompt.character_summary(core_nature, life_progress)
         self.log.log(f'{self.name} generated a character summary: \n {self.character_summary}')
+        if cache_path:
+            os.makedirs(self.summary_cache_folder, exist_ok=True)
+            with open(cache_path, 'w') as file:
+                json.dump({'name': self.name, 'character_summary': self.character_summary}, file)
+
+    def summary_cache_path(self, core_statements: List[str], progress_statements: List[str]) -> str:
+        """Path of the cached summary for these inputs (None without a summary cache)."""
+        if self.summary_cache_folder is None:
+            return None
+        key = hashlib.sha256(json.dumps([self.LLM.chat_model, self.name, self.pronoun, self.age, self.traits, self.seed,
+                                         core_statements, progress_statements]).encode()).hexdigest()
+        return os.path.join(self.summary_cache_folder, f'{key}.json')
 
     def observe(self, observation: str, time) -> None:
         """Record observation."""
         self.memory.record(observation, time)
+
+    def observe_many(self, observations: List[str], time) -> None:
+        """Record several observations (rated and embedded in batches)."""
+        self.memory.record_many(observations, [time] * len(observations))
     
     def reflect(self, time) -> None:
-        """Condense last [self.reflection_buffer_length] memories into a high-level reflection (also entered into the memory stream)."""
-        recent_memories = self.memory.memories_text[-self.reflection_buffer_length:]
+        """Condense last [self.reflection_buffer_length] memories into a high-level reflection (also entered into the memory stream).
+        The memories for every salient question are retrieved in one batched query and the insights are generated concurrently."""
+        recent_memories = self.memory.recent(self.reflection_buffer_length)
         msg_stream = [{'role':'system', 'content': self.prompt.WORLD_PREDICATE},
                       {'role':'user', 'content':self.prompt.salient_questions(recent_memories)}]
-        questions = self.LLM.complete(msg_stream).split('\n')
+        questions = [question for question in self.LLM.complete(msg_stream, phase='reflect', caller=self.name).split('\n') if question.strip()]
         self.log.log(f'salient questions for {self.name}: {";".join(questions)}')
-        for question in questions: 
-            relevant_memories = self.memory.query(question, 5, time)
-            insight = self.LLM.complete([{'role':'system', 'content': self.prompt.WORLD_PREDICATE + self.prompt.GENERAL_STYLE_PREDICATE},
-                                          {'role':'user', 'content':self.prompt.insight(relevant_memories)}])
-            self.memory.record(insight, time)
+        all_relevant_memories = Memory.query_many([(self.memory, question, 5) for question in questions], time)
+        insights = map_concurrently(lambda relevant_memories: self.LLM.complete([{'role':'system', 'content': self.prompt.GENERAL_SYSTEM},
+                                                                                {'role':'user', 'content':self.prompt.insight(relevant_memories)}],
+                                                                               phase='reflect', caller=self.name), all_relevant_memories)
+        for question, insight in zip(questions, insights):
             self.log.log(f'{self.name} had the following reflection: {insight} in response to the question {question}.')
+        self.memory.record_many(insights, [time] * len(insights))
+        self.memory.importance_since_reflection = 0
+
+    def maybe_reflect(self, time) -> bool:
+        """Reflect if enough has happened since the last reflection (see reflection_importance_threshold). Returns whether it did."""
+        if self.reflection_importance_threshold is not None and self.memory.importance_since_reflection < self.reflection_importance_threshold:
+            return False
+        self.reflect(time)
+        return True
 
     def dialogue(self, status: str, dialogue_history: List[str], receiver_name: str, time) -> str:
         """Generate a reply to the receiver given the current dialogue history.
         dialogue_history: [name: speech, name: speech...]
         status: what the NPC is currently doing in the world"""
-        relevant_memories_receiver = self.memory.query(f'Who is {receiver_name}?', 1, time)
-        relevant_memories_dialogue = self.memory.query(dialogue_history[-1], 3, time) if len(dialogue_history) > 0 else []
-        context = self.LLM.complete(message_stream=[{'role':'user', 'content':self.prompt.dialogue_context(receiver_name, relevant_memories_receiver, relevant_memories_dialogue)}])
-        self.log.log(f'Dialogue prompt: {self.prompt.dialogue(status, context, dialogue_history, time)}')
-        return self.LLM.complete(message_stream=[{'role':'system', 'content': self.prompt.WORLD_PREDICATE + self.prompt.DIALOGUE_STYLE_PREDICATE + self.prompt.DIALOGUE_STYLE_PREDICATE_EXAMPLE}, 
-                                                 {'role':'user', 'content':self.prompt.dialogue(status, context, dialogue_history, time)}])
-
-    def synthesize_dialogue(self, status: str, dialogue_history: List[str], time) -> None:
-        """Summarize conversation and enter into memory."""
-        summary = self.LLM.complete(message_stream=[{'role': 'system', 'content': self.prompt.WORLD_PREDICATE + self.prompt.GENERAL_STYLE_PREDICATE},
-                                                    {'role': 'user', 'content': self.prompt.dialogue_summary(status, dialogue_history, time)}])
-        for statement in summary.split('\n'): self.observe(statement, time)
+        return self.LLM.complete(message_stream=self.dialogue_messages(status, dialogue_history, receiver_name, time),
+                                 phase='dialogue', caller=self.name)
+
+    def dialogue_stream(self, status: str, dialogue_history: List[str], receiver_name: str, time) -> Generator[str, None, str]:
+        """Like dialogue, but yield the reply's text deltas as they are generated. The generator returns the full reply."""
+        reply = yield from self.LLM.complete_stream(message_stream=self.dialogue_messages(status, dialogue_history, receiver_name, time),
+                                                    phase='dialogue', caller=self.name)
+        self.log.log(f'{self.name} replied: {reply}')
+        return reply
+
+    def dialogue_messages(self, status: str, dialogue_history: List[str], receiver_name: str, time) -> List[Dict]:
+        """Build the message stream for the next dialogue reply."""
+        context = self.dialogue_context(receiver_name, dialogue_history, time)
+        dialogue_prompt = self.prompt.dialogue(status, context, self.compact_history(dialogue_history, receiver_name, 'dialogue'), time)
+        self.log.log(f'Dialogue prompt: {dialogue_prompt}')
+        return [{'role':'system', 'content': self.prompt.dialogue_system()}, 
+                {'role':'user', 'content':dialogue_prompt}]
+
+    def dialogue_context(self, receiver_name: str, dialogue_history: List[str], time) -> str:
+        """Summarize what the NPC remembers that is relevant to the conversation. The summary is cached per conversation and
+        only regenerated when the retrieved memories change materially."""
+        requests = [(self.memory, f'Who is {receiver_name}?', 1)]
+        if len(dialogue_history) > 0: requests.append((self.memory, dialogue_history[-1], 3))
+        memory_ids = Memory.query_many_ids(requests, time)
+        cached = self.dialogue_contexts.setdefault(receiver_name, NPC.DialogueContext())
+        retrieved = set(int(idx) for ids in memory_ids for idx in ids)
+        if cached.context is not None and cached.overlap(retrieved) >= self.context_reuse_threshold:
+            return cached.context
+        relevant_memories_receiver = self.memory.stream.texts(memory_ids[0])
+        relevant_memories_dialogue = self.memory.stream.texts(memory_ids[1]) if len(memory_ids) > 1 else []
+        context = self.LLM.complete(message_stream=[{'role':'user', 'content':self.prompt.dialogue_context(receiver_name, relevant_memories_receiver, relevant_memories_dialogue)}],
+                                    phase='context', caller=self.name)
+        cached.memory_ids, cached.context = retrieved, context
+        return context
+
+    def compact_history(self, dialogue_history: List[str], receiver_name: str, prompt_type: str) -> List[str]:
+        """Return the dialogue history to paste into a prompt of the given type: once the turns not yet summarized exceed the
+        type's token budget, the oldest are rolled into the conversation's running summary (one LLM call) until half the
+        budget remains."""
+        budget = self.prompt.HISTORY_TOKEN_BUDGETS[prompt_type]
+        conversation = self.dialogue_contexts.setdefault(receiver_name, NPC.DialogueContext())
+        if conversation.summarized_turns > len(dialogue_history): # a new conversation reusing the partner's entry
+            conversation.history_summary, conversation.summarized_turns = '', 0
+        turn_tokens = [count_tokens(turn) for turn in dialogue_history]
+        if sum(turn_tokens[conversation.summarized_turns:]) > budget:
+            end, remaining = conversation.summarized_turns, sum(turn_tokens[conversation.summarized_turns:])
+            while end < len(dialogue_history) - 1 and remaining > budget // 2:
+                remaining -= turn_tokens[end]
+                end += 1
+            conversation.history_summary = self.LLM.complete(message_stream=[{'role': 'system', 'content': self.prompt.GENERAL_SYSTEM},
+                                                                             {'role': 'user', 'content': self.prompt.history_summary(conversation.history_summary, dialogue_history[conversation.summarized_turns:end])}],
+                                                             phase='summary', caller=self.name)
+            conversation.summarized_turns = end
+            self.log.log(f'{self.name} condensed {end} turns of the conversation with {receiver_name}: {conversation.history_summary}')
+        if not conversation.summarized_turns:
+            return dialogue_history
+        compacted = [f'(Earlier: {conversation.history_summary})'] + dialogue_history[conversation.summarized_turns:]
+        self.prompt_tokens_saved += sum(turn_tokens) - sum(count_tokens(turn) for turn in compacted[:1]) - sum(turn_tokens[conversation.summarized_turns:])
+        return compacted
+
+    def end_conversation(self, receiver_name: str) -> None:
+        """Forget the cached dialogue context of a finished conversation."""
+        self.dialogue_contexts.pop(receiver_name, None)
+
+    def synthesize_dialogue(self, status: str, dialogue_history: List[str], time, receiver_name: str = None) -> None:
+        """Summarize conversation and enter into memory.
+        receiver_name: if given (and the conversation has not ended), reuse that conversation's running summary."""
+        dialogue_history = self.compact_history(dialogue_history, receiver_name, 'dialogue_summary')
+        if receiver_name is None: self.end_conversation(None)
+        summary = self.LLM.complete(message_stream=[{'role': 'system', 'content': self.prompt.summary_system()},
+                                                    {'role': 'user', 'content': self.prompt.dialogue_summary(status, dialogue_history, time)}],
+                                    phase='summary', caller=self.name)
+        self.observe_many([statement for statement in summary.split('\n') if statement.strip()], time)
+
+    def snapshot_arrays(self, prefix: str = '') -> Dict[str, np.ndarray]:
+        """The NPC's state as named arrays: its Memory snapshot plus its characteristics and character summary (UTF-8 JSON)."""
+        state = {'name': self.name, 'pronoun': self.pronoun, 'age': self.age, 'traits': self.traits, 'initial_description': self.seed,
+                 'statuses': self.statuses, 'reflection_buffer_length': self.reflection_buffer_length,
+                 'context_reuse_threshold': self.context_reuse_threshold, 'reflection_importance_threshold': self.reflection_importance_threshold,
+                 'summary_cache_folder': self.summary_cache_folder, 'summary_refresh_memories': self.summary_refresh_memories,
+                 'character_summary': [self.cached_character_summary, self.summary_memory_count], 'is_alive': self.is_alive}
+        arrays = {f'{prefix}memory.{key}': array for key, array in self.memory.snapshot().items()}
+        arrays[f'{prefix}npc'] = np.frombuffer(json.dumps(state).encode('utf-8'), dtype=np.uint8)
+        return arrays
+
+    @classmethod
+    def restore_arrays(cls, arrays: Dict[str, np.ndarray], LLM: GPTEndpoint, log: Log, prefix: str = '', shared_indexes: Dict = None) -> 'NPC':
+        """Rebuild an NPC from snapshot_arrays (no LLM or embedding calls). shared_indexes: see Memory.load."""
+        state = json.loads(arrays[f'{prefix}npc'].tobytes().decode('utf-8'))
+        character_summary, summary_memory_count = state.pop('character_summary')
+        is_alive = state.pop('is_alive', True)
+        memory = Memory.restore({key[len(f'{prefix}memory.'):]: arrays[key] for key in arrays if key.startswith(f'{prefix}memory.')}, LLM, log, shared_indexes)
+        npc = cls(**state, time=None, memory=memory, LLM=LLM, log=log, record_seed=False)
+        npc.cached_character_summary, npc.summary_memory_count = character_summary, summary_memory_count
+        npc.is_alive = is_alive
+        return npc
+
+    def snapshot(self, path: str) -> None:
+        """Write the NPC to a single .npz file (see restore)."""
+        np.savez(path, **self.snapshot_arrays())
+
+    @classmethod
+    def restore(cls, path: str, LLM: GPTEndpoint, log: Log) -> 'NPC':
+        """Load an NPC written by snapshot."""
+        with np.load(path) as arrays:
+            return cls.restore_arrays({key: arrays[key] for key in arrays.files}, LLM, log)
 
     def random_state(self):
         '''
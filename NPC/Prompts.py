@@ -2,6 +2,9 @@
 
 class Prompts:
 
+    # Token budget for the dialogue history pasted into each prompt type; older turns are rolled into a running summary.
+    HISTORY_TOKEN_BUDGETS = {'dialogue': 1000, 'dialogue_summary': 2000}
+
     def __init__(self, NPC) -> None:
 
         self.NPC = NPC
@@ -23,6 +26,19 @@ class Prompts:
                                                                     'Elara: Oh my gosh! That is like, so hard to believe.',
                                                                     'Drogan: Roarrr! Treasure? Mine!'
                                                                 ])
+
+        # Static system segments, assembled once: every request of a type starts with the same bytes (static first, volatile
+        # fields last), so provider-side prompt caching can reuse the shared prefix.
+        self.GENERAL_SYSTEM = self.WORLD_PREDICATE + self.GENERAL_STYLE_PREDICATE
+        self.DIALOGUE_SYSTEM = self.WORLD_PREDICATE + self.DIALOGUE_STYLE_PREDICATE + self.DIALOGUE_STYLE_PREDICATE_EXAMPLE
+
+    def dialogue_system(self):
+        """system message for dialogue: static predicates, then the NPC's character summary"""
+        return self.DIALOGUE_SYSTEM + '\n' + self.NPC.character_summary
+
+    def summary_system(self):
+        """system message for summarizing as the NPC: static predicates, then the NPC's character summary"""
+        return self.GENERAL_SYSTEM + '\n' + self.NPC.character_summary
     
     def core_characteristics(self, statements):
         """statements: statements relevant to core characteristics of NPC"""
@@ -42,36 +58,42 @@ class Prompts:
 
     def insight(self, relevant_memories):
         """generate insight from memories (out: reflection)"""
-        return '\n'.join(relevant_memories) + '\n' + 'What one-sentence high-level insight can you infer from the above statements?'
+        return 'What one-sentence high-level insight can you infer from the following statements?' + '\n' + '\n'.join(relevant_memories)
     
     @staticmethod
     def player_emotion_level(player, NPC, relevant_memories):
-        return '\n'.join(relevant_memories) + '\n' + f'Based on the dialogue between {player} and {NPC}, generate a number from -10 to 10 based on how much {player} seems to likes or dislikes {NPC}. -10 means an absolute hatred, 0 means completely neutral, and 10 means absolute love. YOU CAN ONLY RETURN A NUMBER FROM -10 to 10! '
+        return 'Generate a number from -10 to 10. -10 means an absolute hatred, 0 means completely neutral, and 10 means absolute love. YOU CAN ONLY RETURN A NUMBER FROM -10 to 10! ' + \
+                f'Based on the following dialogue between {player} and {NPC}, generate a number from -10 to 10 based on how much {player} seems to likes or dislikes {NPC}.' + '\n' + '\n'.join(relevant_memories)
     
     def emotion_level(self, reciever_name, relevant_memories):
         '''generate emotion level from -10 to 10'''
-        return '\n'.join(relevant_memories) + '\n' + f'Based on these memories about {reciever_name} from {self.NPC.name}, generate a number from -10 to 10 based on how much {self.NPC.name} likes or dislikes {reciever_name}. -10 means an absolute hatred, 0 means completely neutral, and 10 means absolute love. YOU CAN ONLY RETURN A NUMBER FROM -10 to 10! '
+        return 'Generate a number from -10 to 10. -10 means an absolute hatred, 0 means completely neutral, and 10 means absolute love. YOU CAN ONLY RETURN A NUMBER FROM -10 to 10! ' + \
+                f'Based on the following memories about {reciever_name} from {self.NPC.name}, generate a number from -10 to 10 based on how much {self.NPC.name} likes or dislikes {reciever_name}.' + '\n' + '\n'.join(relevant_memories)
     
     def dialogue_context(self, receiver_name, relevant_memories_receiver, relevant_memories_dialogue):
         """summarize NPC's memories that are relevant to what's being spoken about"""
-        return f'{self.NPC.name} is speaking to {receiver_name}. Briefly summarize the context given what {self.NPC.name} remembers: \n' + '\n'.join(relevant_memories_receiver + relevant_memories_dialogue)
+        return f'Briefly summarize the context given what {self.NPC.name} remembers. {self.NPC.name} is speaking to {receiver_name}: \n' + '\n'.join(relevant_memories_receiver + relevant_memories_dialogue)
     
     def dialogue(self, status, context, dialogue_history, time):
-        """dialogue prompt"""
-        return self.NPC.character_summary + '\n' + \
-                str(time) + '\n' + \
-                status + '\n' + \
-                f'You ONLY know whatever is in the following context. Summary of relevant context from {self.NPC.name}\'s memory: ' + \
+        """dialogue prompt (follows dialogue_system; the character summary lives there)"""
+        return f'You ONLY know whatever is in the following context. Summary of relevant context from {self.NPC.name}\'s memory: ' + \
                 context + '\n' \
                 'Here is the dialogue history:' + '\n' + \
                 '\n'.join(dialogue_history) + '\n' + \
+                str(time) + '\n' + \
+                status + '\n' + \
                 f'You are {self.NPC.name}. How would you respond?'
     
+    def history_summary(self, previous_summary, dialogue_turns):
+        """condense older dialogue turns (and the summary of anything before them) into a running summary"""
+        return 'Condense the earlier part of this conversation into a few sentences, keeping names, facts and promises: \n' + \
+                (f'Summary so far: {previous_summary}' + '\n' if previous_summary else '') + \
+                '\n'.join(dialogue_turns)
+
     def dialogue_summary(self, status, dialogue_history, time):
-        """dialogue summary prompt"""
-        return self.NPC.character_summary + '\n' + \
-                str(time) + '\n' + \
-                status + '\n' + \
+        """dialogue summary prompt (follows summary_system; the character summary lives there)"""
+        return 'Succinctly summarize the conversation into two or three salient, new-line separated statements based primarily on the given dialogue history.' + '\n' + \
                 'Dialogue history:' + '\n' + \
                 '\n'.join(dialogue_history) + '\n' + \
-                f'Succinctly summarize the conversation into two or three salient, new-line separated statements based primarily on the given dialogue history..'
\ No newline at end of file
+                str(time) + '\n' + \
+                status
\ No newline at end of file
@@ -0,0 +1,128 @@
+import faiss
+import threading
+import numpy as np
+from typing import Dict, List, Tuple
+from NPC.MemoryIndex import MemoryIndex
+
+class SharedMemoryIndex:
+    """
+        Registry of the memory indexes of every NPC in a world, grouped by owner: each owner gets its own exact
+        (flat inner-product) index on first use. Nothing is searched across owners: search covers one owner's vectors, and
+        search_many splits a batch of queries from many NPCs by owner and runs one batched search per owner in the batch.
+
+        Give each NPC's Memory a view: Memory(..., index=shared_index.view(name)).
+        Operations hold a lock, so NPCs in concurrent conversations may share the index.
+    """
+
+    class View:
+        """The part of a SharedMemoryIndex owned by one NPC. Usable anywhere Memory expects a MemoryIndex."""
+
+        def __init__(self, shared: 'SharedMemoryIndex', owner: str) -> None:
+            self.shared = shared
+            self.owner = owner
+            self.owner_number = shared.owner_number(owner)
+            self.dim = shared.dim
+            self.kind = 'flat'
+
+        @property
+        def ntotal(self) -> int:
+            return self.shared.indexes[self.owner_number].ntotal
+
+        def add(self, vectors: np.ndarray, ids: np.ndarray) -> None:
+            self.shared.add(self.owner_number, vectors, ids)
+
+        def remove(self, ids: np.ndarray) -> None:
+            self.shared.remove(self.owner_number, ids)
+
+        def renumber(self, new_ids: np.ndarray) -> None:
+            self.shared.renumber(self.owner_number, new_ids)
+
+        def search(self, queries: np.ndarray, k: int) -> Tuple[np.ndarray, np.ndarray]:
+            return self.shared.search(self.owner_number, queries, k)
+
+        def vectors(self) -> Tuple[np.ndarray, np.ndarray]:
+            return self.shared.vectors(self.owner_number)
+
+        def params(self) -> Dict:
+            """Flat MemoryIndex parameters, marked shared with the owner so Memory.load / restore can rejoin a SharedMemoryIndex."""
+            return dict(MemoryIndex(self.dim).params(), shared=True, owner=self.owner)
+
+        def save(self, path: str) -> None:
+            """Save this owner's vectors as a standalone flat index (see Memory.rejoin_shared_index)."""
+            faiss.write_index(self.standalone(), path)
+
+        def serialize(self) -> np.ndarray:
+            """Like save, as a uint8 array."""
+            return faiss.serialize_index(self.standalone())
+
+        def standalone(self) -> faiss.IndexIDMap2:
+            ids, vectors = self.vectors()
+            index = faiss.IndexIDMap2(faiss.IndexFlatIP(self.dim))
+            if len(ids): index.add_with_ids(vectors, ids)
+            return index
+
+    def __init__(self, dim: int) -> None:
+        self.dim = dim
+        self.owners: Dict[str, int] = {}
+        self.indexes: List[faiss.IndexIDMap2] = [] # owner number -> that owner's flat index (ids are memory ids)
+        self.lock = threading.RLock()
+
+    def owner_number(self, owner: str) -> int:
+        with self.lock:
+            if owner not in self.owners:
+                self.owners[owner] = len(self.owners)
+                self.indexes.append(faiss.IndexIDMap2(faiss.IndexFlatIP(self.dim)))
+            return self.owners[owner]
+
+    def view(self, owner: str) -> 'SharedMemoryIndex.View':
+        return SharedMemoryIndex.View(self, owner)
+
+    @property
+    def ntotal(self) -> int:
+        return sum(index.ntotal for index in self.indexes)
+
+    def add(self, owner_number: int, vectors: np.ndarray, ids: np.ndarray) -> None:
+        with self.lock:
+            self.indexes[owner_number].add_with_ids(np.ascontiguousarray(vectors, dtype=np.float32), np.asarray(ids, dtype=np.int64))
+
+    def remove(self, owner_number: int, ids: np.ndarray) -> None:
+        with self.lock:
+            self.indexes[owner_number].remove_ids(np.asarray(ids, dtype=np.int64))
+
+    def renumber(self, owner_number: int, new_ids: np.ndarray) -> None:
+        """Change every memory id of one owner: id i becomes new_ids[i] (see MemoryIndex.renumber)."""
+        with self.lock:
+            index = self.indexes[owner_number]
+            faiss.copy_array_to_vector(np.asarray(new_ids, dtype=np.int64)[faiss.vector_to_array(index.id_map)], index.id_map)
+            index.construct_rev_map()
+
+    def search(self, owner_number: int, queries: np.ndarray, k: int) -> Tuple[np.ndarray, np.ndarray]:
+        """Search one owner's memories. Returns (squared L2 distances, memory ids), like MemoryIndex.search."""
+        with self.lock:
+            similarities, ids = self.indexes[owner_number].search(np.ascontiguousarray(queries, dtype=np.float32), k)
+        distances = np.full(similarities.shape, np.inf, dtype=np.float32)
+        distances[ids >= 0] = np.maximum(2 - 2 * similarities[ids >= 0], 0)
+        return distances, ids
+
+    def search_many(self, owners: List[str], queries: np.ndarray, k: int) -> Tuple[np.ndarray, np.ndarray]:
+        """Row i searches the memories of owners[i] with queries[i]; the rows of each owner are searched together in one call.
+        Returns (squared L2 distances, memory ids), padded with id -1 where an owner has fewer than k memories."""
+        queries = np.ascontiguousarray(queries, dtype=np.float32)
+        distances, ids = np.full((len(queries), k), np.inf, dtype=np.float32), np.full((len(queries), k), -1, dtype=np.int64)
+        if k == 0:
+            return distances, ids
+        rows_by_owner: Dict[int, List[int]] = {}
+        for row, owner in enumerate(owners):
+            rows_by_owner.setdefault(self.owners[owner], []).append(row)
+        for owner_number, rows in rows_by_owner.items():
+            distances[rows], ids[rows] = self.search(owner_number, queries[rows], k)
+        return distances, ids
+
+    def vectors(self, owner_number: int) -> Tuple[np.ndarray, np.ndarray]:
+        """Return (memory ids, vectors) of one owner."""
+        with self.lock:
+            index = self.indexes[owner_number]
+            if index.ntotal == 0:
+                return np.empty(0, dtype=np.int64), np.empty((0, self.dim), dtype=np.float32)
+            stored = faiss.rev_swig_ptr(faiss.downcast_index(index.index).get_xb(), index.ntotal * self.dim)
+            return faiss.vector_to_array(index.id_map).copy(), stored.reshape(index.ntotal, self.dim).copy()
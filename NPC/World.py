@@ -0,0 +1,99 @@
+import json
+import time as wall_clock
+import numpy as np
+from typing import Callable, Dict, List
+from NPC.NPC import NPC
+from NPC.Memory import Memory
+from NPC.MemoryIndex import MemoryIndex
+from NPC.SharedMemoryIndex import SharedMemoryIndex
+from NPC.Grapevine import Grapevine
+from GPTEndpoint import GPTEndpoint
+from Log import Log
+
+class World:
+    '''
+        A world definition (JSON, see WORLD/example_world.json): the player, the NPCs with their seed statements, and the
+        Grapevine edges. build turns it into a Grapevine of NPCs, embedding the seed statements of every NPC together in as few
+        embedding calls as possible (EMBEDDING_BATCH_SIZE texts each) instead of one call per statement.
+
+        Definition format:
+            player: name of the player
+            memory: Memory parameters shared by every NPC (see MEMORY_DEFAULTS); "index" holds MemoryIndex parameters,
+                and "shared_index": true registers every NPC's index in one SharedMemoryIndex
+            npcs: list of {name, pronoun, age, traits, description, statuses, ...}; description is a list of seed statements
+                (or a ;-separated string), and any other key is passed to NPC (e.g. reflection_buffer_length, or memory
+                to override the shared Memory parameters)
+            edges: list of [x, y, Dxy, Exy]
+    '''
+
+    EMBEDDING_BATCH_SIZE = 2048 # max inputs per embeddings request
+
+    MEMORY_DEFAULTS = {'importance_threshold': 3, 'embeddings_batch_size': 5, 'embedding_length': 256,
+                       'recency_weight': 1, 'relevance_weight': 1, 'importance_weight': 1}
+
+    NPC_DEFAULTS = {'reflection_buffer_length': 10}
+
+    def __init__(self, definition: Dict) -> None:
+        self.definition = definition
+        self.player = definition['player']
+        self.npcs: List[Dict] = definition['npcs']
+        self.edges = [tuple(edge) for edge in definition.get('edges', [])]
+
+    @classmethod
+    def from_file(cls, path: str) -> 'World':
+        with open(path, 'r') as file:
+            return cls(json.load(file))
+
+    @staticmethod
+    def seed_statements(npc: Dict) -> List[str]:
+        description = npc['description']
+        statements = description.split(';') if isinstance(description, str) else description
+        return [statement.strip() for statement in statements if statement.strip()]
+
+    def build(self, LLM: GPTEndpoint, log: Log, time=None, clock: Callable[[], float] = None) -> Grapevine:
+        '''
+            Creates every NPC (seed statements recorded with importance 10 at the given time, default the clock's time) and the
+            Grapevine, which keeps the clock (default: wall-clock time; see Grapevine)
+        '''
+        clock = wall_clock.time if clock is None else clock
+        time = clock() if time is None else time
+        memory_params = dict(World.MEMORY_DEFAULTS, **self.definition.get('memory', {}))
+        shared_indexes: Dict[int, SharedMemoryIndex] = {}
+
+        # memories
+        memories, statements = [], []
+        for npc in self.npcs:
+            params = dict(memory_params, **npc.get('memory', {}))
+            index_params, shared = params.pop('index', {}), params.pop('shared_index', False)
+            if shared:
+                shared_index = shared_indexes.setdefault(params['embedding_length'], SharedMemoryIndex(params['embedding_length']))
+                index = shared_index.view(npc['name'])
+            else:
+                index = MemoryIndex(params['embedding_length'], **index_params)
+            memories.append(Memory(**params, gpt_endpoint=LLM, log=log, index=index, owner=npc['name']))
+            statements.append(World.seed_statements(npc))
+
+        # embed the seeds of every NPC together, one batch of texts per embedding size
+        by_dim: Dict[int, List[str]] = {}
+        for memory, npc_statements in zip(memories, statements):
+            by_dim.setdefault(memory.embedding_dim, []).extend(npc_statements)
+        embeddings: Dict[int, Dict[str, np.ndarray]] = {}
+        for dim, texts in by_dim.items():
+            texts = list(dict.fromkeys(texts))
+            embeddings[dim] = {}
+            for start in range(0, len(texts), World.EMBEDDING_BATCH_SIZE):
+                batch = texts[start:start + World.EMBEDDING_BATCH_SIZE]
+                embeddings[dim].update(zip(batch, LLM.embedding(batch, dimensions=dim, phase='embedding', caller='world')))
+        for memory, npc_statements in zip(memories, statements):
+            if npc_statements:
+                memory.record_embedded(npc_statements, [time] * len(npc_statements), [10] * len(npc_statements),
+                                       np.array([embeddings[memory.embedding_dim][statement] for statement in npc_statements]))
+        log.log(f'World seeded {sum(len(npc_statements) for npc_statements in statements)} statements for {len(self.npcs)} NPCs.')
+
+        # NPCs and Grapevine
+        NPCs = []
+        for npc, memory in zip(self.npcs, memories):
+            params = dict(World.NPC_DEFAULTS, **{key: value for key, value in npc.items() if key not in ('description', 'memory')})
+            NPCs.append(NPC(**params, initial_description=';'.join(World.seed_statements(npc)), time=time,
+                            memory=memory, LLM=LLM, log=log, record_seed=False))
+        return Grapevine(self.player, NPCs, self.edges, LLM, log, clock=clock)
@@ -1,4 +1,5 @@
 import numpy as np
+from concurrent.futures import ThreadPoolExecutor
 
 def normalize_vectors(vectors):
     norms = np.linalg.norm(vectors, axis=1, keepdims=True)
@@ -7,3 +8,18 @@ def normalize_vectors(vectors):
 def scale_to_range(numbers, MAX=1):
     min_val, max_val = min(numbers), max(numbers)
     return [MAX * (x - min_val) / (max_val - min_val) if max_val > min_val else 0 for x in numbers]
+
+
+def scale_array(values: np.ndarray, MAX=1) -> np.ndarray:
+    """Vectorized scale_to_range."""
+    min_val, max_val = values.min(), values.max()
+    return MAX * (values - min_val) / (max_val - min_val) if max_val > min_val else np.zeros(len(values))
+
+def map_concurrently(function, items, max_workers=8) -> list:
+    """[function(item) for item in items], with the calls run on a thread pool (for I/O-bound work such as LLM calls).
+    Results keep the order of items; the first exception raised is re-raised."""
+    items = list(items)
+    if len(items) <= 1:
+        return [function(item) for item in items]
+    with ThreadPoolExecutor(max_workers=min(max_workers, len(items))) as executor:
+        return list(executor.map(function, items))
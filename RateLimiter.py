@@ -0,0 +1,52 @@
+import time
+import asyncio
+import threading
+
+class TokenBucket:
+    """Token bucket refilled at a constant rate. Callers reserve tokens up front (the bucket may go into debt),
+    so waiting callers are served in arrival order instead of being dropped."""
+
+    def __init__(self, rate: float, capacity: float) -> None:
+        """
+            rate: tokens added per second.
+            capacity: maximum number of tokens the bucket can hold (burst size).
+        """
+        self.rate = rate
+        self.capacity = capacity
+        self.tokens = capacity
+        self.timestamp = time.monotonic()
+        self.lock = threading.Lock()
+
+    def reserve(self, amount: float = 1) -> float:
+        """Take amount tokens from the bucket and return the number of seconds the caller must wait before using them."""
+        with self.lock:
+            now = time.monotonic()
+            self.tokens = min(self.capacity, self.tokens + (now - self.timestamp) * self.rate)
+            self.timestamp = now
+            self.tokens -= min(amount, self.capacity) # an oversized request would otherwise never fit
+            return 0 if self.tokens >= 0 else -self.tokens / self.rate
+
+
+class RateLimiter:
+    """Request and token rate limits (either may be None for unlimited) shared by sync and async callers."""
+
+    def __init__(self, requests_per_minute: float = None, tokens_per_minute: float = None, request_burst: float = None) -> None:
+        """request_burst: requests that may be sent back to back (default: one second's worth, at least 1)."""
+        if request_burst is None and requests_per_minute: request_burst = max(1, requests_per_minute / 60)
+        self.request_bucket = TokenBucket(requests_per_minute / 60, request_burst) if requests_per_minute else None
+        self.token_bucket = TokenBucket(tokens_per_minute / 60, tokens_per_minute) if tokens_per_minute else None
+
+    def reserve(self, tokens: int = 0) -> float:
+        """Reserve one request using the given number of tokens; return the seconds to wait before sending it."""
+        return max(self.request_bucket.reserve(1) if self.request_bucket else 0,
+                   self.token_bucket.reserve(tokens) if self.token_bucket else 0)
+
+    def acquire(self, tokens: int = 0) -> None:
+        """Block until one request using the given number of tokens may be sent."""
+        delay = self.reserve(tokens)
+        if delay > 0: time.sleep(delay)
+
+    async def aacquire(self, tokens: int = 0) -> None:
+        """Async version of acquire."""
+        delay = self.reserve(tokens)
+        if delay > 0: await asyncio.sleep(delay)
@@ -0,0 +1,100 @@
+import os
+import json
+import base64
+import hashlib
+import threading
+from collections import defaultdict
+from typing import Dict, List
+import numpy as np
+
+class ReplayMiss(KeyError):
+    """Raised in replay mode when a call was never recorded."""
+
+
+class ReplayStore:
+    """Append-only store of LLM calls, one compact JSON record per line.
+        mode='record': every completion / embedding served live by the GPTEndpoint is appended to the file.
+        mode='replay': calls are answered from the file without touching the network. A request recorded several times
+            replays its responses in recorded order (the last one repeats once exhausted), so replays are deterministic.
+        Requests must match exactly, and prompts include the current time: replay Grapevine ticks with the same deterministic
+        clock they were recorded with (see Grapevine and benchmarks/replay.py)."""
+
+    def __init__(self, path: str, mode: str = 'replay') -> None:
+        assert mode in ('record', 'replay'), f'Unknown replay store mode {mode}.'
+        self.path = path
+        self.mode = mode
+        self.lock = threading.Lock()
+        self.completions: Dict[str, List[str]] = defaultdict(list)
+        self.embeddings: Dict[str, np.ndarray] = {}
+        self.completion_calls: Dict[str, int] = defaultdict(int) # key -> number of times replayed
+        if os.path.exists(path):
+            self.load()
+        elif os.path.dirname(path):
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+
+    @property
+    def recording(self) -> bool:
+        return self.mode == 'record'
+
+    @property
+    def replaying(self) -> bool:
+        return self.mode == 'replay'
+
+    @staticmethod
+    def completion_key(model: str, message_stream: List[Dict]) -> str:
+        return hashlib.sha256(json.dumps([model, message_stream], sort_keys=True).encode()).hexdigest()
+
+    @staticmethod
+    def embedding_key(model: str, dimensions: int, text: str) -> str:
+        return hashlib.sha256(f'{model}\x00{dimensions}\x00{text}'.encode()).hexdigest()
+
+    def load(self) -> None:
+        """Build the lookup index from the file."""
+        with open(self.path, 'r') as file:
+            for line in file:
+                if not line.strip(): continue
+                record = json.loads(line)
+                if 'r' in record:
+                    self.completions[record['k']].append(record['r'])
+                else:
+                    self.embeddings[record['k']] = np.frombuffer(base64.b64decode(record['e']), dtype=np.float32)
+
+    def append(self, records: List[Dict]) -> None:
+        with self.lock, open(self.path, 'a') as file:
+            file.writelines(json.dumps(record, separators=(',', ':')) + '\n' for record in records)
+
+    def record_completion(self, model: str, message_stream: List[Dict], response: str) -> None:
+        key = self.completion_key(model, message_stream)
+        self.completions[key].append(response)
+        self.append([{'k': key, 'r': response}])
+
+    def record_embeddings(self, model: str, dimensions: int, texts: List[str], embeddings: np.ndarray) -> None:
+        records = []
+        for text, embedding in zip(texts, embeddings):
+            key = self.embedding_key(model, dimensions, text)
+            if key in self.embeddings: continue # embeddings are deterministic, store each text once
+            vector = np.asarray(embedding, dtype=np.float32)
+            self.embeddings[key] = vector
+            records.append({'k': key, 'e': base64.b64encode(vector.tobytes()).decode()})
+        if records: self.append(records)
+
+    def replay_completion(self, model: str, message_stream: List[Dict]) -> str:
+        key = self.completion_key(model, message_stream)
+        if key not in self.completions:
+            raise ReplayMiss(f'No recorded completion for {message_stream}.')
+        with self.lock:
+            responses = self.completions[key]
+            response = responses[min(self.completion_calls[key], len(responses) - 1)]
+            self.completion_calls[key] += 1
+        return response
+
+    def replay_embeddings(self, model: str, dimensions: int, texts: List[str]) -> np.ndarray:
+        keys = [self.embedding_key(model, dimensions, text) for text in texts]
+        for key, text in zip(keys, texts):
+            if key not in self.embeddings:
+                raise ReplayMiss(f'No recorded embedding for {text}.')
+        return np.array([self.embeddings[key] for key in keys])
+
+    def rewind(self) -> None:
+        """Restart every replay sequence from its first recorded response."""
+        self.completion_calls.clear()
@@ -0,0 +1,22 @@
+from typing import Dict, List
+
+try:
+    import tiktoken
+except ImportError: # optional: fall back to a character-based estimate
+    tiktoken = None
+
+ENCODING = 'cl100k_base' # gpt-3.5-turbo / text-embedding-3 tokenizer
+_encoder = None
+
+def count_tokens(text: str) -> int:
+    """Number of tokens in text (exact with tiktoken installed, otherwise ~4 characters per token)."""
+    global _encoder
+    if tiktoken is None:
+        return len(text) // 4 + 1
+    if _encoder is None:
+        _encoder = tiktoken.get_encoding(ENCODING)
+    return len(_encoder.encode(text, disallowed_special=()))
+
+def count_message_tokens(message_stream: List[Dict]) -> int:
+    """Prompt tokens of a chat message stream (each message carries ~4 tokens of overhead)."""
+    return sum(count_tokens(message['content']) + 4 for message in message_stream) + 2
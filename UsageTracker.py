@@ -0,0 +1,151 @@
+import os
+import json
+import bisect
+import threading
+from collections import defaultdict
+from typing import Dict, List, Tuple
+from Log import Log
+from Tokens import count_tokens
+
+class CallRecord:
+    """One LLM call as seen by the GPTEndpoint."""
+
+    __slots__ = ('model', 'phase', 'caller', 'prompt_tokens', 'completion_tokens', 'latency', 'wait', 'cost')
+
+    def __init__(self, model: str, phase: str, caller: str, prompt_tokens: int, completion_tokens: int, latency: float, wait: float, cost: float) -> None:
+        self.model = model
+        self.phase = phase
+        self.caller = caller
+        self.prompt_tokens = prompt_tokens
+        self.completion_tokens = completion_tokens
+        self.latency = latency # wall seconds, including wait
+        self.wait = wait # seconds queued on the rate limiter / concurrency cap
+        self.cost = cost # USD
+
+
+class UsageAggregate:
+    """Running totals of a set of calls. No per-call data is kept: latency percentiles are estimated from the histogram."""
+
+    __slots__ = ('calls', 'prompt_tokens', 'completion_tokens', 'cost', 'latency_total', 'latency_max', 'wait_total', 'latency_histogram')
+
+    def __init__(self) -> None:
+        self.calls = 0
+        self.prompt_tokens = 0
+        self.completion_tokens = 0
+        self.cost = 0.0
+        self.latency_total = 0.0
+        self.latency_max = 0.0
+        self.wait_total = 0.0
+        self.latency_histogram = [0] * (len(UsageTracker.LATENCY_BUCKETS) + 1)
+
+    def add(self, record: CallRecord) -> None:
+        self.calls += 1
+        self.prompt_tokens += record.prompt_tokens
+        self.completion_tokens += record.completion_tokens
+        self.cost += record.cost
+        self.latency_total += record.latency
+        self.latency_max = max(self.latency_max, record.latency)
+        self.wait_total += record.wait
+        self.latency_histogram[bisect.bisect_left(UsageTracker.LATENCY_BUCKETS, record.latency)] += 1
+
+    def latency_quantile(self, q: float) -> float:
+        """Latency below which a fraction q of the calls fall, interpolated linearly inside its histogram bucket."""
+        rank, below = q * self.calls, 0
+        for bucket, count in enumerate(self.latency_histogram):
+            if count and below + count >= rank:
+                lower = UsageTracker.LATENCY_BUCKETS[bucket - 1] if bucket else 0
+                upper = UsageTracker.LATENCY_BUCKETS[bucket] if bucket < len(UsageTracker.LATENCY_BUCKETS) else self.latency_max
+                return min(lower + (upper - lower) * (rank - below) / count, self.latency_max)
+            below += count
+        return 0
+
+    def report(self) -> Dict:
+        return {'calls': self.calls, 'prompt_tokens': self.prompt_tokens, 'completion_tokens': self.completion_tokens,
+                'cost': self.cost, 'latency_total': self.latency_total,
+                'latency_p50': self.latency_quantile(0.5), 'latency_p95': self.latency_quantile(0.95), 'latency_max': self.latency_max,
+                'wait_total': self.wait_total, 'latency_histogram': list(self.latency_histogram)}
+
+
+class UsageTracker:
+    """
+        Per-call token, cost and latency accounting for a GPTEndpoint, attributed to a phase (importance, summary, reflect,
+        dialogue, context, emotion, embedding, ...) and a caller (the NPC that made the call).
+        Calls are folded into running aggregates as they are recorded (memory stays constant however long the game runs):
+        one set covers everything (see summary), the other the calls since the last tick (see tick_report).
+        prefix_report measures, per phase, how much of each prompt repeats the start of an earlier prompt of that phase (the
+        previous one overall or the caller's previous one): the part provider-side prompt caching can reuse.
+    """
+
+    LATENCY_BUCKETS = [0.05, 0.1, 0.25, 0.5, 1, 2, 5, 10, 30] # histogram upper bounds (seconds); the last bucket is open
+
+    # USD per 1M (prompt, completion) tokens
+    PRICES = {'gpt-3.5-turbo-0125': (0.5, 1.5), 'gpt-4o-mini': (0.15, 0.6), 'gpt-4o': (2.5, 10),
+              'text-embedding-3-small': (0.02, 0), 'text-embedding-3-large': (0.13, 0)}
+
+    def __init__(self) -> None:
+        self.totals = self.new_totals() # every call
+        self.tick_totals = self.new_totals() # calls since the last tick_report
+        self.lock = threading.Lock()
+        self.last_prompts: Dict[Tuple[str, str], str] = {} # (phase, caller or None) -> previous prompt
+        self.prefix_totals: Dict[str, List[int]] = defaultdict(lambda: [0, 0, 0]) # phase -> [calls, shared prefix tokens, prompt tokens]
+
+    @staticmethod
+    def new_totals() -> Dict:
+        return {'total': UsageAggregate(), 'by_phase': defaultdict(UsageAggregate), 'by_caller': defaultdict(UsageAggregate)}
+
+    def record(self, model: str, phase: str, caller: str, prompt_tokens: int, completion_tokens: int, latency: float, wait: float = 0) -> None:
+        prompt_price, completion_price = UsageTracker.PRICES.get(model, (0, 0))
+        cost = (prompt_tokens * prompt_price + completion_tokens * completion_price) / 1e6
+        record = CallRecord(model, phase, caller, prompt_tokens, completion_tokens, latency, wait, cost)
+        with self.lock:
+            for totals in (self.totals, self.tick_totals):
+                totals['total'].add(record)
+                totals['by_phase'][phase].add(record)
+                totals['by_caller'][str(caller)].add(record)
+
+    def record_prompt(self, phase: str, caller: str, prompt: str, prompt_tokens: int) -> None:
+        """Count how much of a completion prompt (messages joined in order) is shared with earlier prompts of its phase."""
+        with self.lock:
+            previous = [self.last_prompts.get((phase, None), ''), self.last_prompts.get((phase, caller), '')]
+            self.last_prompts[(phase, None)] = self.last_prompts[(phase, caller)] = prompt
+        shared = max((os.path.commonprefix([earlier, prompt]) for earlier in previous), key=len)
+        shared_tokens = count_tokens(shared) if shared else 0
+        with self.lock:
+            totals = self.prefix_totals[phase]
+            totals[0] += 1
+            totals[1] += min(shared_tokens, prompt_tokens)
+            totals[2] += prompt_tokens
+
+    def prefix_report(self) -> Dict:
+        """Per phase: calls, mean shared-prefix and prompt tokens, and the shared fraction of all prompt tokens."""
+        with self.lock:
+            return {phase: {'calls': calls, 'shared_prefix_tokens': shared / calls, 'prompt_tokens': prompt / calls,
+                            'shared_fraction': shared / prompt if prompt else 0}
+                    for phase, (calls, shared, prompt) in self.prefix_totals.items()}
+
+    @staticmethod
+    def report(totals: Dict) -> Dict:
+        return {'total': totals['total'].report(),
+                'by_phase': {phase: aggregate.report() for phase, aggregate in totals['by_phase'].items()},
+                'by_caller': {caller: aggregate.report() for caller, aggregate in totals['by_caller'].items()}}
+
+    def summary(self) -> Dict:
+        """Totals plus breakdowns by phase and by caller for every call so far."""
+        with self.lock:
+            return self.report(self.totals)
+
+    def tick_report(self) -> Dict:
+        """Summary of the calls since the previous tick_report, then start a new tick."""
+        with self.lock:
+            report = self.report(self.tick_totals)
+            self.tick_totals = self.new_totals()
+        return report
+
+    @staticmethod
+    def export(log: Log, title: str, report: Dict) -> None:
+        """Write a report to the log (one JSON line per section)."""
+        log.log(f'{title} usage total: {json.dumps(report["total"])}')
+        for phase, aggregate in report['by_phase'].items():
+            log.log(f'{title} usage phase={phase}: {json.dumps(aggregate)}')
+        for caller, aggregate in report['by_caller'].items():
+            log.log(f'{title} usage caller={caller}: {json.dumps(aggregate)}')
@@ -0,0 +1,55 @@
+"""
+    Recall@k and query latency of the MemoryIndex kinds (HNSW at several ef_search, IVF at several nprobe) against the
+    exact flat baseline, on clustered synthetic embeddings. Usage (from the repository root):
+        python -m benchmarks.ann_index [n_memories ...]
+"""
+import sys
+import time
+import numpy as np
+from NPC.MemoryIndex import MemoryIndex
+from NPC.utils import normalize_vectors
+
+SIZES = [10000, 100000]
+DIM = 256
+K = 10
+QUERIES = 200
+CONFIGS = [('flat', {})] + \
+          [('hnsw', {'ef_search': ef}) for ef in (16, 32, 64, 128)] + \
+          [('ivf', {'nprobe': nprobe}) for nprobe in (4, 16, 64)]
+
+def synthetic_embeddings(n: int, rng: np.random.Generator) -> np.ndarray:
+    """Unit vectors scattered around a few hundred topics, like memories about recurring people and places."""
+    topics = rng.standard_normal((300, DIM))
+    return normalize_vectors(topics[rng.integers(0, len(topics), n)] + 0.6 * rng.standard_normal((n, DIM))).astype(np.float32)
+
+def build(kind: str, params: dict, vectors: np.ndarray) -> MemoryIndex:
+    index = MemoryIndex(DIM, **params)
+    index.add(vectors, np.arange(len(vectors)))
+    if kind != 'flat': index.migrate(kind) # same path as the automatic upgrade
+    return index
+
+def run(n: int) -> None:
+    rng = np.random.default_rng(0)
+    vectors = synthetic_embeddings(n, rng)
+    queries = synthetic_embeddings(QUERIES, rng)
+    truth = None
+    print(f'\n{n} memories, recall@{K} over {QUERIES} queries')
+    print(f'{"index":>20} {"build (s)":>10} {"recall":>8} {"query (ms)":>11}')
+    for kind, params in CONFIGS:
+        start = time.perf_counter()
+        index = build(kind, params, vectors)
+        build_time = time.perf_counter() - start
+        latencies, results = [], []
+        for query in queries:
+            start = time.perf_counter()
+            _, ids = index.search(query.reshape(1, -1), K)
+            latencies.append((time.perf_counter() - start) * 1000)
+            results.append(ids[0])
+        if truth is None: truth = results
+        recall = np.mean([len(np.intersect1d(found, exact)) / K for found, exact in zip(results, truth)])
+        label = kind + ''.join(f' {key}={value}' for key, value in params.items())
+        print(f'{label:>20} {build_time:>10.2f} {recall:>8.3f} {np.median(latencies):>11.3f}')
+
+if __name__ == '__main__':
+    for n in [int(arg) for arg in sys.argv[1:]] or SIZES:
+        run(n)
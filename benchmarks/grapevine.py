@@ -0,0 +1,66 @@
+"""
+    Per-tick bookkeeping of Grapevine vs MatrixGrapevine (no LLM calls): sampling the tick's conversations and pushing an
+    emotion update to every edge, at 1k / 5k NPCs with 100 / 200 edges per NPC, and a get_subset_by_strength query per NPC
+    (cached sorted neighbors, after the first pass). Usage (from the repository root):
+        python -m benchmarks.grapevine [n_NPCs:edges_per_NPC ...]
+"""
+import sys
+import time
+import random
+from types import SimpleNamespace
+import numpy as np
+from NPC.Grapevine import Grapevine
+from NPC.MatrixGrapevine import MatrixGrapevine
+
+SIZES = [(1000, 100), (5000, 40)]
+
+def synthetic_edges(n: int, degree: int, rng: np.random.Generator) -> list:
+    """Each NPC gets degree outgoing edges to random other NPCs."""
+    src = np.repeat(np.arange(n), degree)
+    dst = (src + rng.integers(1, n, len(src))) % n
+    keep = np.unique(src * n + dst, return_index=True)[1]
+    return [(f'N{x}', f'N{y}', float(D), float(E)) for x, y, D, E in
+            zip(src[keep].tolist(), dst[keep].tolist(), rng.uniform(0, 10, len(keep)).round(2), rng.uniform(0, 10, len(keep)).round(2))]
+
+def best_of(function, repeats: int = 3) -> float:
+    """Best wall time in milliseconds."""
+    times = []
+    for _ in range(repeats):
+        start = time.perf_counter()
+        function()
+        times.append((time.perf_counter() - start) * 1000)
+    return min(times)
+
+def update_every_edge(graph: Grapevine) -> None:
+    for x in graph.grapevine:
+        for edge in graph.grapevine[x].values():
+            edge.update_emotion(5)
+
+def subset_every_node(graph: Grapevine) -> None:
+    for x in graph.grapevine:
+        graph.get_subset_by_strength(x, 5)
+
+def run(n: int, degree: int) -> None:
+    rng = np.random.default_rng(0)
+    NPCs = [SimpleNamespace(name=f'N{i}') for i in range(n)]
+    edges = synthetic_edges(n, degree, rng)
+    start = time.perf_counter()
+    graph = Grapevine('Player', NPCs, edges, None)
+    build_dict = (time.perf_counter() - start) * 1000
+    start = time.perf_counter()
+    matrix = MatrixGrapevine('Player', NPCs, edges, None, seed=0)
+    build_matrix = (time.perf_counter() - start) * 1000
+    random.seed(0)
+    sample_dict, sample_matrix = best_of(graph.sample_conversations), best_of(matrix.sample_conversations)
+    update_dict = best_of(lambda: update_every_edge(graph), 1)
+    update_matrix = best_of(lambda: matrix.update_emotions(np.arange(len(matrix.keys)), np.full(len(matrix.keys), 5.0)))
+    subset_dict, subset_matrix = best_of(lambda: subset_every_node(graph)), best_of(lambda: subset_every_node(matrix))
+    print(f'{n:>6} {len(edges):>8} {build_dict:>11.0f} {build_matrix:>11.0f} {sample_dict:>12.1f} {sample_matrix:>12.1f} '
+          f'{update_dict:>12.1f} {update_matrix:>12.1f} {subset_dict:>12.1f} {subset_matrix:>12.1f}')
+
+if __name__ == '__main__':
+    sizes = [tuple(int(part) for part in arg.split(':')) for arg in sys.argv[1:]] or SIZES
+    print(f'{"NPCs":>6} {"edges":>8} {"build dict":>11} {"build mat":>11} {"sample dict":>12} {"sample mat":>12} '
+          f'{"update dict":>12} {"update mat":>12} {"subset dict":>12} {"subset mat":>12}   (ms)')
+    for n, degree in sizes:
+        run(n, degree)
@@ -0,0 +1,48 @@
+"""
+    Memory.query latency per candidate pool size (top-k only, 10*k, entire stream) at 1k, 10k and 100k memories, with the
+    query embeddings already cached.
+    Runs offline on MockBackend. Usage (from the repository root): python -m benchmarks.memory_query
+"""
+import sys
+import time
+import random
+import numpy as np
+from GPTEndpoint import GPTEndpoint
+from MockBackend import MockBackend
+from NPC.Memory import Memory
+from Log import Log
+
+SIZES = [1000, 10000, 100000]
+K = 5
+QUERIES = 50
+EMBEDDING_DIM = 256
+
+def build_memory(n: int, LLM: GPTEndpoint, log: Log) -> Memory:
+    memory = Memory(importance_threshold=1, embeddings_batch_size=1000, embedding_length=EMBEDDING_DIM,
+                    recency_weight=1, relevance_weight=1, importance_weight=1, gpt_endpoint=LLM, log=log)
+    rng = random.Random(0)
+    for i in range(n):
+        memory.record(f'Memory number {i} about {rng.choice(MockBackend.SUBJECTS)}.', timestamp=i, memory_importance=rng.randint(1, 10))
+    return memory
+
+def time_queries(memory: Memory, pool_size: int) -> float:
+    """Median query latency in milliseconds. The query embeddings are cached beforehand, so every pool size is timed on
+    retrieval and ranking alone."""
+    memory.candidate_pool_size = pool_size
+    queries = [f'What happened with {MockBackend.SUBJECTS[q % len(MockBackend.SUBJECTS)]}? ({q})' for q in range(QUERIES)]
+    memory.embed_queries(queries)
+    latencies = []
+    for query in queries:
+        start = time.perf_counter()
+        memory.query(query, K, current_time=len(memory.memories_text))
+        latencies.append((time.perf_counter() - start) * 1000)
+    return float(np.median(latencies))
+
+if __name__ == '__main__':
+    sizes = [int(arg) for arg in sys.argv[1:]] or SIZES
+    LLM = GPTEndpoint('', backend=MockBackend())
+    log = Log(disabled=True)
+    print(f'{"memories":>10} {"top-k (ms)":>12} {"10*k (ms)":>12} {"full (ms)":>12}')
+    for n in sizes:
+        memory = build_memory(n, LLM, log)
+        print(f'{n:>10} {time_queries(memory, None):>12.3f} {time_queries(memory, 10 * K):>12.3f} {time_queries(memory, -1):>12.3f}')
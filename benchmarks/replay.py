@@ -0,0 +1,69 @@
+"""
+    Record-then-replay check of Grapevine ticks: a seeded synthetic world (see benchmarks.simulate) runs a few ticks on
+    MockBackend while a ReplayStore records every call, then the same world runs again answered only from the store (its
+    backend refuses every request). Both runs use the same deterministic clock, so the replay must make the same calls and
+    leave every NPC with the same memories. Reports the wall time of the recorded and the replayed ticks.
+    Usage (from the repository root): python -m benchmarks.replay [n_NPCs ...] [--ticks T] [--density p] [--seed s]
+"""
+import os
+import time
+import random
+import argparse
+import itertools
+import tempfile
+from typing import Dict, List, Tuple
+from GPTEndpoint import GPTEndpoint
+from MockBackend import MockBackend
+from ReplayStore import ReplayStore
+from NPC.World import World
+from Log import Log
+from benchmarks.simulate import synthetic_world, DENSITY, SEED
+
+SIZES = [10, 30]
+TICKS = 2
+START_TIME = 1.7e9 # the clock starts here and advances an hour per reading
+
+class NoBackend:
+    """Backend for the replay run: any request that reaches it was not answered by the ReplayStore."""
+
+    def complete(self, *args, **kwargs):
+        raise AssertionError('Replay run sent a completion to the backend.')
+
+    def complete_stream(self, *args, **kwargs):
+        raise AssertionError('Replay run sent a completion to the backend.')
+
+    def embedding(self, *args, **kwargs):
+        raise AssertionError('Replay run sent an embedding request to the backend.')
+
+def run_ticks(definition: Dict, LLM: GPTEndpoint, ticks: int, seed: int) -> Tuple[float, Dict[str, List[str]]]:
+    """Wall seconds of the ticks and every NPC's memories afterwards."""
+    random.seed(seed) # Grapevine.does_convo_occur
+    grapevine = World(definition).build(LLM, Log(disabled=True), clock=itertools.count(START_TIME, 3600.0).__next__)
+    start = time.perf_counter()
+    for _ in range(ticks):
+        grapevine.tick_info_diffusion()
+    return time.perf_counter() - start, {name: list(npc.memory.stream) for name, npc in grapevine.name_to_NPC.items()}
+
+def run(n: int, ticks: int, density: float, seed: int, workdir: str) -> None:
+    definition = synthetic_world(n, density, seed)
+    path = os.path.join(workdir, f'replay_{n}.jsonl')
+    recorder = GPTEndpoint('', backend=MockBackend(seed=seed), replay_store=ReplayStore(path, 'record'))
+    record_s, recorded = run_ticks(definition, recorder, ticks, seed)
+    replayer = GPTEndpoint('', backend=NoBackend(), replay_store=ReplayStore(path, 'replay'))
+    replay_s, replayed = run_ticks(definition, replayer, ticks, seed)
+    calls = recorder.usage.summary()['total']['calls']
+    assert replayer.usage.summary()['total']['calls'] == calls, 'replay made different calls'
+    assert replayed == recorded, 'replay left different memories'
+    print(f'{n:>6} {ticks:>6} {calls:>8} {record_s:>11.2f} {replay_s:>11.2f}   ok')
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('sizes', nargs='*', type=int, default=SIZES)
+    parser.add_argument('--ticks', type=int, default=TICKS)
+    parser.add_argument('--density', type=float, default=DENSITY)
+    parser.add_argument('--seed', type=int, default=SEED)
+    args = parser.parse_args()
+    print(f'{"NPCs":>6} {"ticks":>6} {"calls":>8} {"record (s)":>11} {"replay (s)":>11}')
+    with tempfile.TemporaryDirectory() as workdir:
+        for n in args.sizes:
+            run(n, args.ticks, args.density, args.seed, workdir)
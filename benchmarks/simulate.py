@@ -0,0 +1,128 @@
+"""
+    End-to-end simulation of synthetic worlds on MockBackend (offline and deterministic): N NPCs with random edges
+    (each pair connected both ways with probability density), built with World, then ticks of Grapevine.tick_info_diffusion
+    followed by one player dialogue, NPC.reflect and Memory.query per NPC. Reports ticks/s, LLM calls and tokens per tick,
+    wall / CPU time per phase, memory stream growth and peak RSS, and writes the results as JSON to benchmarks/results/
+    (one file per world size, named by commit; the folder is gitignored) so runs can be compared across commits.
+    Usage (from the repository root): python -m benchmarks.simulate [n_NPCs ...] [--ticks T] [--density p] [--seed s]
+"""
+import os
+import json
+import time
+import random
+import argparse
+import resource
+import subprocess
+from typing import Callable, Dict
+from GPTEndpoint import GPTEndpoint
+from MockBackend import MockBackend
+from NPC.World import World
+from NPC.Grapevine import Grapevine
+from Log import Log
+
+SIZES = [10, 50]
+TICKS = 3
+DENSITY = 0.2
+SEED = 0
+STATEMENTS = 8
+RESULTS_FOLDER = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'results')
+
+TRAITS = ['loyal', 'witty', 'secretive', 'greedy', 'kind', 'lazy', 'curious', 'blunt', 'weary', 'gossipy']
+STATUSES = ['working', 'resting at the tavern', 'walking through the Town', 'sleeping']
+
+def synthetic_world(n: int, density: float, seed: int) -> Dict:
+    """World definition of n NPCs; each pair is connected both ways (Grapevine updates x -> y and y -> x after a
+    conversation) with probability density. Exy stays in [1, 4] to bound the length of simulated conversations."""
+    rng = random.Random(seed)
+    npcs = [{'name': f'NPC{i}', 'pronoun': rng.choice(['his', 'her']), 'age': rng.randint(18, 80), 'traits': rng.sample(TRAITS, 3),
+             'description': [f'NPC{i} {rng.choice(["knows about", "fears", "wants", "talks about"])} {rng.choice(MockBackend.SUBJECTS)} ({j}).'
+                             for j in range(STATEMENTS)],
+             'statuses': rng.sample(STATUSES, 2)} for i in range(n)]
+    pairs = [(x, y, round(rng.uniform(0, 10), 1)) for x in range(n) for y in range(x + 1, n) if rng.random() < density]
+    edges = [[f'NPC{a}', f'NPC{b}', D, round(rng.uniform(1, 4), 1)] for x, y, D in pairs for a, b in ((x, y), (y, x))]
+    edges += [edge for i in range(min(n, 3)) for edge in (['Player', f'NPC{i}', 2, 0], [f'NPC{i}', 'Player', 2, 0])]
+    return {'player': 'Player', 'npcs': npcs, 'edges': edges}
+
+def peak_rss_mb() -> float:
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024 # KB on Linux
+
+def commit() -> str:
+    try:
+        return subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], capture_output=True, text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return 'unknown'
+
+def measure(LLM: GPTEndpoint, function: Callable[[], None]) -> Dict:
+    """Wall and CPU seconds of one call, the LLM usage it caused (total and by LLM phase) and the peak RSS after it."""
+    before = LLM.usage.summary()
+    wall, cpu = time.perf_counter(), time.process_time()
+    function()
+    wall, cpu = time.perf_counter() - wall, time.process_time() - cpu
+    after = LLM.usage.summary()
+    def usage(aggregate: Dict, earlier: Dict) -> Dict:
+        return {'calls': aggregate['calls'] - earlier.get('calls', 0),
+                'tokens': aggregate['prompt_tokens'] + aggregate['completion_tokens'] - earlier.get('prompt_tokens', 0) - earlier.get('completion_tokens', 0)}
+    total = usage(after['total'], before['total'])
+    by_phase = {phase: usage(aggregate, before['by_phase'].get(phase, {})) for phase, aggregate in after['by_phase'].items()}
+    return {'wall_s': wall, 'cpu_s': cpu, 'calls': total['calls'], 'tokens': total['tokens'],
+            'by_llm_phase': {phase: phase_usage for phase, phase_usage in by_phase.items() if phase_usage['calls']},
+            'peak_rss_mb': peak_rss_mb()}
+
+def memory_stats(grapevine: Grapevine) -> Dict:
+    NPCs = grapevine.name_to_NPC.values()
+    return {'memories': sum(npc.memory_count() for npc in NPCs), 'memory_bytes': sum(npc.memory.nbytes for npc in NPCs)}
+
+def run(n: int, ticks: int, density: float, seed: int) -> Dict:
+    random.seed(seed) # Grapevine.does_convo_occur
+    LLM = GPTEndpoint('', backend=MockBackend(seed=seed))
+    log = Log(disabled=True)
+    world = World(synthetic_world(n, density, seed))
+    built = {}
+    phases = {'build': measure(LLM, lambda: built.update(grapevine=world.build(LLM, log, time=0)))}
+    grapevine = built['grapevine']
+    memory = [memory_stats(grapevine)]
+
+    tick_results = []
+    for _ in range(ticks):
+        tick_results.append(measure(LLM, grapevine.tick_info_diffusion))
+        memory.append(memory_stats(grapevine))
+    phases['tick'] = {key: sum(tick[key] for tick in tick_results) for key in ('wall_s', 'cpu_s', 'calls', 'tokens')}
+    phases['tick']['peak_rss_mb'] = peak_rss_mb()
+
+    NPCs = list(grapevine.name_to_NPC.values())
+    phases['dialogue'] = measure(LLM, lambda: [npc.dialogue(npc.statuses[0], ['Hello!'], grapevine.player, time.time()) for npc in NPCs])
+    phases['reflect'] = measure(LLM, lambda: [npc.reflect(time.time()) for npc in NPCs])
+    phases['query'] = measure(LLM, lambda: [npc.memory.query(f'What do you know about {MockBackend.SUBJECTS[i % len(MockBackend.SUBJECTS)]}?', 5, time.time())
+                                            for i, npc in enumerate(NPCs)])
+    memory.append(memory_stats(grapevine))
+
+    return {'commit': commit(), 'n_NPCs': n, 'edges': len(world.edges), 'density': density, 'seed': seed, 'ticks': ticks,
+            'ticks_per_s': ticks / phases['tick']['wall_s'] if phases['tick']['wall_s'] else 0,
+            'calls_per_tick': phases['tick']['calls'] / ticks, 'tokens_per_tick': phases['tick']['tokens'] / ticks,
+            'phases': phases, 'per_tick': tick_results,
+            'memory': {'after_build': memory[0], 'after_ticks': memory[1:ticks + 1], 'final': memory[-1],
+                       'growth_per_tick': (memory[ticks]['memories'] - memory[0]['memories']) / ticks}}
+
+def save(result: Dict) -> str:
+    os.makedirs(RESULTS_FOLDER, exist_ok=True)
+    path = os.path.join(RESULTS_FOLDER, f'simulate_{result["n_NPCs"]}npcs_{result["commit"]}.json')
+    with open(path, 'w') as file:
+        json.dump(result, file, indent=2)
+    return path
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('sizes', nargs='*', type=int, default=SIZES)
+    parser.add_argument('--ticks', type=int, default=TICKS)
+    parser.add_argument('--density', type=float, default=DENSITY)
+    parser.add_argument('--seed', type=int, default=SEED)
+    args = parser.parse_args()
+    print(f'{"NPCs":>6} {"edges":>7} {"ticks/s":>8} {"calls/tick":>11} {"tokens/tick":>12} {"tick cpu (s)":>13} '
+          f'{"dialogue (s)":>13} {"reflect (s)":>12} {"query (ms)":>11} {"memories +/tick":>16} {"peak RSS (MB)":>14}')
+    for n in args.sizes:
+        result = run(n, args.ticks, args.density, args.seed)
+        phases = result['phases']
+        print(f'{n:>6} {result["edges"]:>7} {result["ticks_per_s"]:>8.2f} {result["calls_per_tick"]:>11.1f} {result["tokens_per_tick"]:>12.0f} '
+              f'{phases["tick"]["cpu_s"]:>13.2f} {phases["dialogue"]["wall_s"]:>13.2f} {phases["reflect"]["wall_s"]:>12.2f} '
+              f'{phases["query"]["wall_s"] * 1000:>11.1f} {result["memory"]["growth_per_tick"]:>16.1f} {phases["query"]["peak_rss_mb"]:>14.0f}')
+        print(f'       -> {save(result)}')
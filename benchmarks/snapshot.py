@@ -0,0 +1,66 @@
+"""
+    NPC.snapshot / NPC.restore time and file size at 10k and 100k memories, next to the per-folder Memory.save / Memory.load,
+    and the embedding calls a restart would otherwise spend re-recording the memories. Runs offline on MockBackend.
+    Usage (from the repository root): python -m benchmarks.snapshot [n_memories ...]
+"""
+import os
+import sys
+import time
+import shutil
+import tempfile
+from GPTEndpoint import GPTEndpoint
+from MockBackend import MockBackend
+from NPC.Memory import Memory
+from NPC.NPC import NPC
+from Log import Log
+from benchmarks.memory_query import build_memory
+
+SIZES = [10000, 100000]
+REPEATS = 5
+
+def build_npc(n: int, LLM: GPTEndpoint, log: Log) -> NPC:
+    memory = build_memory(n, LLM, log)
+    npc = NPC('Alaric', 'his', 30, ['kind', 'stubborn'], 'Alaric is a farmer;Alaric fears the baron', ['farming'],
+              n, 5, memory, LLM, log)
+    npc.character_summary # built once, then stored in the snapshot
+    return npc
+
+def best_of(function) -> float:
+    """Best wall time in milliseconds."""
+    times = []
+    for _ in range(REPEATS):
+        start = time.perf_counter()
+        function()
+        times.append((time.perf_counter() - start) * 1000)
+    return min(times)
+
+def folder_size(folder: str) -> int:
+    return sum(os.path.getsize(os.path.join(folder, name)) for name in os.listdir(folder))
+
+def run(n: int, workdir: str) -> None:
+    LLM = GPTEndpoint('', backend=MockBackend())
+    log = Log(disabled=True)
+    npc = build_npc(n, LLM, log)
+    embedding_calls = LLM.usage.summary()['by_phase']['embedding']['calls']
+    path, folder = os.path.join(workdir, f'npc_{n}.npz'), os.path.join(workdir, f'memory_{n}')
+    snapshot_ms = best_of(lambda: npc.snapshot(path))
+    calls_before = LLM.usage.summary()['total']['calls']
+    restore_ms = best_of(lambda: NPC.restore(path, LLM, log))
+    assert LLM.usage.summary()['total']['calls'] == calls_before, 'restore must not call the LLM'
+    restored = NPC.restore(path, LLM, log)
+    assert restored.character_summary == npc.character_summary and list(restored.memory.stream) == list(npc.memory.stream)
+    save_ms = best_of(lambda: npc.memory.save(folder))
+    load_ms = best_of(lambda: Memory.load(folder, LLM, log, mmap=False))
+    print(f'{n:>10} {snapshot_ms:>14.1f} {restore_ms:>13.1f} {os.path.getsize(path) / 2**20:>10.1f} '
+          f'{save_ms:>10.1f} {load_ms:>10.1f} {folder_size(folder) / 2**20:>12.1f} {embedding_calls:>16}')
+
+if __name__ == '__main__':
+    sizes = [int(arg) for arg in sys.argv[1:]] or SIZES
+    workdir = tempfile.mkdtemp()
+    print(f'{"memories":>10} {"snapshot (ms)":>14} {"restore (ms)":>13} {"npz (MB)":>10} '
+          f'{"save (ms)":>10} {"load (ms)":>10} {"folder (MB)":>12} {"rebuild (calls)":>16}')
+    try:
+        for n in sizes:
+            run(n, workdir)
+    finally:
+        shutil.rmtree(workdir)